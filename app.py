@@ -13,6 +13,7 @@ import secrets
 from flask import Flask, redirect, url_for
 from flask_cors import CORS
 from models import db
+from migrations.migrations import run_migrations
 from search.search_routes import search_bp
 from books.books_routes import books_bp
 from book.book_routes import book_bp
@@ -21,12 +22,17 @@ from authors.authors_routes import authors_bp
 from genres.genres_routes import genres_bp
 from series.series_routes import series_bp
 from downloader.downloader_routes import downloader_bp
+from downloader.downloader import schedule_cover_download
 from recommendations.recommendations_routes import recommendations_bp
 from tools.fix import fix_bp
 from tools.ping_routes import ping_bp
 from book_collections.collections_routes import collections_bp
 from files.file_routes import files_bp
+from files.cover_routes import covers_bp
+from cache.cache_routes import cache_bp
 from tools.import_path_routes import import_path_bp
+from tools.import_jobs import init_import_jobs
+from tools.watch_routes import watch_bp, init_watch_folder
 
 app = Flask(__name__, static_folder='static')
 CORS(app)  # Enable CORS for all routes
@@ -38,6 +44,7 @@ db.init_app(app)
 
 with app.app_context():
     db.create_all()
+    run_migrations()
 
 app.register_blueprint(search_bp)
 app.register_blueprint(books_bp)
@@ -52,7 +59,13 @@ app.register_blueprint(fix_bp)
 app.register_blueprint(ping_bp)
 app.register_blueprint(collections_bp)
 app.register_blueprint(files_bp)
+app.register_blueprint(covers_bp)
 app.register_blueprint(import_path_bp)
+app.register_blueprint(cache_bp)
+app.register_blueprint(watch_bp)
+init_import_jobs(app)
+init_watch_folder(app)
+schedule_cover_download(app)
 
 
 @app.route('/')
@@ -64,6 +77,4 @@ if __name__ == '__main__':
 
 with app.app_context():
     db.create_all()
-    # TODO re-enable later
-    #downloader.schedule_cover_download(app)
 
@@ -1,10 +1,14 @@
 from flask import Blueprint, jsonify, redirect, url_for
+from cache.etag import conditional_get, library_etag
+from cache.response_cache import cached_response
 from models import Author
 
 authors_bp = Blueprint('authors', __name__, url_prefix='/authors')
 
 
 @authors_bp.route('/api')
+@conditional_get(library_etag)
+@cached_response
 def list_authors_api():
     # take only those authors that have books
     query = Author.query.filter(Author.books.any()).order_by(Author.surname_first).all()
@@ -1,29 +1,149 @@
-from models import Author, db
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import Author, db, match_names
 import re
 
+AUTHOR_CACHE_SIZE = 10000
+RESOLVE_BATCH_SIZE = 500
 
-def fill_author_data(author: Author, name: str):
-    author.name = name #data['author_name'].strip()
-    name_parts = author.name.rsplit(' ', 1)
+
+def author_values(name):
+    """
+    Column values for an author with the given name: name, surname and surname_first.
+    """
+    name_parts = name.rsplit(' ', 1)
     if len(name_parts) == 2:
         given_names, surname = name_parts
     else:
         # Handle edge cases where there's no surname or only one name part
         given_names = name_parts[0]
         surname = ''
-    author.surname_first = f"{surname} {given_names}"
-    author.surname = surname
+    return {'name': name, 'surname': surname, 'surname_first': f"{surname} {given_names}"}
+
+def insert_authors_statement():
+    # author.name is unique, an author inserted by a concurrent import in the meantime
+    # (or a name differing only in case on MariaDB) is skipped and its id is read back like the others
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite_insert(Author).on_conflict_do_nothing(index_elements=[Author.name])
+    elif dialect in ('mysql', 'mariadb'):
+        return mysql_insert(Author).prefix_with('IGNORE')
+    return insert(Author)
+
+def fill_author_data(author: Author, name: str):
+    values = author_values(name) #data['author_name'].strip()
+    author.name = values['name']
+    author.surname_first = values['surname_first']
+    author.surname = values['surname']
     return author
 
+
+class AuthorResolver:
+    """
+    Resolves author names to ids in bulk: known names come from a bounded LRU cache,
+    the rest from one IN query per batch, and the missing authors are inserted with one statement.
+    Authors inserted in a transaction only enter the shared cache once it commits.
+    """
+
+    def __init__(self, max_size=AUTHOR_CACHE_SIZE):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, name):
+        with self._lock:
+            author_id = self._ids.get(name)
+            if author_id is not None:
+                self._ids.move_to_end(name)
+            return author_id
+
+    def remember(self, ids):
+        with self._lock:
+            for name, author_id in ids.items():
+                self._ids[name] = author_id
+                self._ids.move_to_end(name)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._ids.clear()
+
+    def _query_ids(self, session, names):
+        ids = {}
+        for i in range(0, len(names), RESOLVE_BATCH_SIZE):
+            batch = names[i:i + RESOLVE_BATCH_SIZE]
+            rows = session.execute(select(Author.name, Author.id).where(Author.name.in_(batch))).all()
+            # case-insensitive collations (MariaDB) return "John Smith" for "john smith"
+            ids.update(match_names(rows, batch))
+        return ids
+
+    def resolve_ids(self, names, session=None):
+        """
+        Get a name -> author id dictionary, inserting the authors that do not exist yet (without committing).
+        """
+        session = session or db.session
+        pending = session.info.setdefault('pending_authors', {})
+        ids = {}
+        missing = []
+        for name in dict.fromkeys(name for name in names if name):
+            author_id = pending.get(name) or self._cached(name)
+            if author_id is None:
+                missing.append(name)
+            else:
+                ids[name] = author_id
+        if not missing:
+            return ids
+        found = self._query_ids(session, missing)
+        self.remember(found)
+        ids.update(found)
+        new_names = [name for name in missing if name not in found]
+        if new_names:
+            session.execute(insert_authors_statement(), [author_values(name) for name in new_names])
+            inserted = self._query_ids(session, new_names)
+            pending.update(inserted)
+            ids.update(inserted)
+        return ids
+
+    def get_id(self, name, session=None):
+        return self.resolve_ids([name], session).get(name)
+
+
+author_resolver = AuthorResolver()
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_committed_authors(session):
+    pending = session.info.pop('pending_authors', None)
+    if pending:
+        author_resolver.remember(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_authors(session):
+    session.info.pop('pending_authors', None)
+
+
+@event.listens_for(Author, 'after_update')
+@event.listens_for(Author, 'after_delete')
+def _invalidate_author_cache(mapper, connection, target):
+    # a renamed or deleted author can leave stale names in the cache
+    author_resolver.invalidate()
+
+
 def get_author_by_name(name):
-    author = Author.query.filter_by(name=name).first()
-    if author is None:
-        # create a new author
-        author = Author()
-        fill_author_data(author, name)
-        db.session.add(author)
-        db.session.commit()
-    return author
+    author_id = author_resolver.get_id(name)
+    return db.session.get(Author, author_id)
+
+def get_authors_by_names(names):
+    """
+    Get a name -> author id dictionary for many names, see AuthorResolver.resolve_ids.
+    """
+    return author_resolver.resolve_ids(names)
 
 def extract_main_author(author_string):
     # Split by comma, but not inside parentheses
@@ -1,19 +1,34 @@
 from flask import Blueprint, flash, jsonify, redirect, request, session, url_for
-from authors.authors_tools import fill_author_data, get_author_by_name
+from authors.authors_tools import get_author_by_name, get_authors_by_names
+from cache.etag import conditional_get, library_etag, row_etag
+from files.uploads import discard_book_uploads
 from metadata.providers import PROVIDER_AMAZON, PROVIDER_FUNCTIONS, PROVIDER_GOODREADS, PROVIDER_GOOGLE, PROVIDER_LIST, PROVIDER_OPENLIBRARY
-from models import Author, Book, db
+from models import Author, Book, db, sync_book_terms
+from serializers import get_serializer, parse_fields
 from thumbnails.thumbnails import download_cover_image
 from sqlalchemy.orm import joinedload
 
 from tools.deprecated import deprecated
 book_bp = Blueprint('book', __name__, url_prefix='/book')
 
+def book_etag(book_id):
+    # row version of the book, including the author name that is part of the response
+    row = db.session.query(Book.updated_at, Author.name).join(Author).filter(Book.id == book_id).first()
+    if row is None:
+        return None
+    return row_etag(book_id, row.updated_at, row.name)
+
 @book_bp.route('/api/<int:book_id>')
+@conditional_get(book_etag)
 def book_detail_api(book_id):
+    try:
+        serializer = get_serializer(Book, parse_fields(request.args.get('fields')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     book = Book.query.options(joinedload(Book.author)).get_or_404(book_id)
-    return jsonify(book.as_dict())
+    return jsonify(serializer.serialize_object(book))
 
-def fill_book_data(book: Book, data):
+def fill_book_data(book: Book, data, sync_terms=True):
     # json to Book
     fields = {
         'title': 'title',
@@ -40,6 +55,9 @@ def fill_book_data(book: Book, data):
         if key in data and data[key] is not None:
             setattr(book, attr, data[key])
 
+    # batch callers leave this to the before_flush sync, which looks up all books at once
+    if sync_terms:
+        sync_book_terms(db.session, book)
     return book
 
 # TODO rename API method urls
@@ -61,6 +79,46 @@ def add_book_api():
         download_thumbnail(book, data)
     return jsonify({'status': 'success', 'message': 'Book saved successfully', 'id':book.id}), 200
 
+@book_bp.route('/add_books_api', methods=['POST'])
+def add_books_api():
+    """
+    Create many books in one transaction. The body is a list of books in the add_book_api format,
+    the response has a result for each item (by index), so invalid items are reported individually.
+    """
+    data = request.get_json()
+    if not isinstance(data, list) or not data:
+        return jsonify({"error": "Invalid request, expected a JSON list of books"}), 400
+    results = []
+    valid_items = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'status': 'error', 'error': 'Not a JSON object'})
+        elif not item.get('title') or not (item.get('author_name') or '').strip():
+            results.append({'index': index, 'status': 'error', 'error': 'Missing title or author_name'})
+        else:
+            valid_items.append((index, item))
+    # resolve all authors at once, the missing ones are inserted with one statement
+    author_ids = get_authors_by_names(item['author_name'].strip() for _, item in valid_items)
+    created = []
+    for index, item in valid_items:
+        book = Book()
+        fill_book_data(book, item, sync_terms=False)
+        book.author_id = author_ids[item['author_name'].strip()]
+        # remote covers are left to the cover downloader instead of fetching them in the request
+        if book.cover_image and book.cover_image.startswith('http'):
+            book.remote_image_url = book.cover_image
+            book.cover_image = None
+        db.session.add(book)
+        created.append((index, book))
+    db.session.commit()
+    results += [{'index': index, 'status': 'created', 'id': book.id} for index, book in created]
+    results.sort(key=lambda r: r['index'])
+    return jsonify({
+        'status': 'success' if len(created) == len(data) else 'partial',
+        'message': f'Created {len(created)} of {len(data)} books',
+        'results': results,
+    }), 200
+
 # TODO rename API method urls
 @book_bp.route('/<int:book_id>/edit_api', methods=['POST'])
 def edit_book_api(book_id):
@@ -68,14 +126,8 @@ def edit_book_api(book_id):
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid request, no JSON body found"}), 400
-    # author data
-    author = Author.query.filter_by(name=data['author_name']).first()
-    if author is None:
-        # create a new author
-        author = Author()
-        fill_author_data(author, data['author_name'])
-        db.session.add(author)
-        db.session.commit()
+    # author data - maybe the author already exists
+    author = get_author_by_name(data['author_name'])
     fill_book_data(book, data)
     # sometimes the year is formatted like "2023-10-01", so we need to extract the year
     if isinstance(book.year_published, str) and '-' in book.year_published:
@@ -121,12 +173,14 @@ def match_book(book_id):
 @book_bp.route('/<int:book_id>', methods=['DELETE'])
 def delete_book(book_id):
     book = Book.query.get_or_404(book_id)
+    discard_book_uploads([book.id])
     db.session.delete(book)
     db.session.commit()
     return jsonify({'status': 'success', 'message': 'Book deleted successfully'}), 200
 
 # GET /books/<int:book_id>/collections — List collections for a book
 @book_bp.route('/<int:book_id>/collections', methods=['GET'])
+@conditional_get(library_etag)
 def get_collections_for_book(book_id):
     book = Book.query.get_or_404(book_id)
     collections = book.collections
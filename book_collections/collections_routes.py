@@ -1,4 +1,6 @@
 from flask import Blueprint, request, jsonify, abort
+from cache.etag import conditional_get, library_etag
+from cache.response_cache import cached_response
 from models import db
 from models import Book, Collection
 
@@ -6,6 +8,7 @@ collections_bp = Blueprint('collections', __name__, url_prefix='/collections')
 
 # GET /collections — List all collections
 @collections_bp.route('/', methods=['GET'])
+@conditional_get(library_etag)
 def get_collections():
     collections = Collection.query.all()
     return jsonify([
@@ -14,6 +17,8 @@ def get_collections():
     ])
 
 @collections_bp.route('/with_covers', methods=['GET'])
+@conditional_get(library_etag)
+@cached_response
 def get_collections_with_covers():
     collections = Collection.query.all()
     result = []
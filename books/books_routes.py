@@ -1,12 +1,28 @@
 from flask import Blueprint, jsonify, request
-from sqlalchemy import func, or_
-from authors.authors_tools import capitalize_name, get_author_by_name
+from sqlalchemy import func
+from authors.authors_tools import author_resolver, capitalize_name
 from book.book_tools import format_title
-from books.filters import BookFilter
-from books.search_options import NONE_OPTION
+from cache.etag import conditional_get, library_etag
+from cache.response_cache import cached_response
+from books.bulk import (
+    STATUS_DELETED,
+    STATUS_UPDATED,
+    bulk_delete_books,
+    bulk_update_books,
+    parse_book_ids,
+    results_list,
+    updatable_values,
+)
+from books.facets import get_facets
+from books.filters import BookFilter, book_filter_from_args, filter_books
+from books.fulltext import search_ranked
+from books.pagination import apply_keyset, decode_cursor, encode_cursor
+from books.streaming import stream_rows, wants_stream
 from metadata.providers import PROVIDER_FUNCTIONS, PROVIDER_GOOGLE, PROVIDER_LIST
 from models import Author, Book, db
-from thumbnails.thumbnails import download_cover_image
+from serializers import get_serializer, parse_fields
+from files.cover_routes import cover_url
+from thumbnails.thumbnails import cover_variant_filename, download_cover_image
 
 books_bp = Blueprint("books", __name__, url_prefix="/books")
 
@@ -14,8 +30,15 @@ books_bp = Blueprint("books", __name__, url_prefix="/books")
 def add_cover_images(book_list: list):
     # Add a cover image URL for each book
     for book in book_list:
+        if "cover_image" not in book:
+            # not among the requested fields
+            continue
         if book["cover_image"]:
             book["cover_image"] = book["cover_image"]
+            # cacheable URLs of the local covers, see files/cover_routes.py
+            if "id" in book and not book["cover_image"].startswith("http"):
+                book["cover_url"] = cover_url(book["id"], book["cover_image"])
+                book["cover_grid_url"] = cover_url(book["id"], cover_variant_filename("grid"))
         else:
             book["cover_image"] = "placeholder_book.png"
             book["cover_image_tiny"] = "placeholder_book_tiny.png"
@@ -25,43 +48,20 @@ def add_cover_images(book_list: list):
 def add_cover_images_tiny(book_list: list):
     # Add a cover image URL for each book
     for book in book_list:
+        if "cover_image_tiny" not in book:
+            continue
         if not book["cover_image_tiny"]:
             book["cover_image_tiny"] = "placeholder_book_tiny.png"
+        elif "id" in book and not book["cover_image_tiny"].startswith(("http", "placeholder")):
+            book["cover_tiny_url"] = cover_url(book["id"], book["cover_image_tiny"])
     return book_list
 
 
 @books_bp.route("/api/authors", methods=["GET"])
+@conditional_get(library_etag)
+@cached_response
 def list_authors():
-    book_type = request.args.get("type")
-    book_status = request.args.get("status")
-    search = request.args.get("search")
-    author = request.args.get("author")
-    genre = request.args.get("genre")
-    language = request.args.get("language")
-    series = request.args.get("series")
-    pages_min = request.args.get("pages_min")
-    pages_max = request.args.get("pages_max")
-    year_min = request.args.get("year_min")
-    year_max = request.args.get("year_max")
-    rating_min = request.args.get("rating_min")
-    rating_max = request.args.get("rating_max")
-    collection = request.args.get("collection")
-    filter = BookFilter(
-        search=search,
-        book_type=book_type,
-        book_status=book_status,
-        author=author,
-        genre=genre,
-        language=language,
-        series=series,
-        rating_min=rating_min,
-        rating_max=rating_max,
-        pages_min=pages_min,
-        pages_max=pages_max,
-        year_min=year_min,
-        year_max=year_max,
-        collection=collection,
-    )
+    filter = book_filter_from_args(request.args)
     authors = get_authors(db.session, filter)
     return jsonify(authors), 200
 
@@ -85,182 +85,11 @@ def get_authors(session, filters: BookFilter):
     return authors
 
 
-def get_genres(session, filters: BookFilter):
-    """
-    Get a list of genres based on filters.
-
-    :param session: SQLAlchemy session
-    :param filters: Dictionary containing filters (e.g., genre, author, etc.)
-    :return: A list of genres
-    """
-    query = session.query(Book.genre, Author.name).join(Author)
-    query = query.order_by(Book.genre).distinct()
-    query = filter_books(query, filters)
-    result = query.all()
-    # Convert result to a list of genre names
-    genres = [genre[0] for genre in result]
-    # remove the None values
-    genres = [g for g in genres if g is not None]
-    # split the genres if they are comma separated
-    genres = [g.strip() for genre in genres for g in genre.split(",")]
-    # remove duplicates
-    genres = list(set(genres))
-    genres.sort()
-    return genres
-
-
-def get_langages(session, filters: BookFilter):
-    """
-    Get a list of languages based on filters.
-
-    :param session: SQLAlchemy session
-    :param filters: Dictionary containing filters (e.g., genre, author, etc.)
-    :return: A list of languages
-    """
-    query = session.query(Book.language, Author.name).join(Author).order_by(Book.language).distinct()
-    query = filter_books(query, filters)
-    result = query.all()
-    # Convert result to a list of language names
-    languages = [language[0] for language in result]
-    # remove the None values
-    languages = [l for l in languages if l is not None]
-    # split the genres if they are comma separated
-    languages = [l.strip() for lang in languages for l in lang.split(",")]
-    # remove duplicates
-    languages = list(set(languages))
-    languages.sort()
-    return languages
-
-
-def get_series(session, filters: BookFilter):
-    """
-    Get a list of series based on filters.
-
-    :param session: SQLAlchemy session
-    :return: A list of series
-    """
-    query = session.query(Book.series, Author.name).join(Author).order_by(Book.series).distinct()
-    query = filter_books(query, filters)
-    result = query.all()
-    # Convert result to a list of series names
-    series = [s[0] for s in result]
-    # remove the None values
-    series = [s for s in series if s is not None]
-    return series
-
-
-def get_count(session, filters: BookFilter):
-    """
-    Get the count of books based on filters.
-
-    :param session: SQLAlchemy session
-    :param filters: Dictionary containing filters (e.g., genre, author, etc.)
-    :return: A dictionary containing the count of books
-    """
-    query = session.query(func.count(Book.id).label("count"))
-    query = query.join(Author)
-    query = filter_books(query, filters)
-    result = query.one()
-    return result.count
-
-
-def get_min_max_values(session, filters: BookFilter):
-    """
-    Get minimum and maximum values for page_count, year, and rating based on filters.
-
-    :param session: SQLAlchemy session
-    :param filters: Dictionary containing filters (e.g., genre, author, etc.)
-    :return: A dictionary containing min/max values for page_count, year, and rating
-    """
-    # TODO add Authors
-    query = session.query(
-        func.min(Book.page_count).label("min_page_count"),
-        func.max(Book.page_count).label("max_page_count"),
-        func.min(Book.year_published).label("min_year"),
-        func.max(Book.year_published).label("max_year"),
-        func.min(Book.rating).label("min_rating"),
-        func.max(Book.rating).label("max_rating"),
-    )
-    query = query.join(Author)
-    query = filter_books(query, filters)
-    result = query.one()
-    return {
-        "page_count": {"min": result.min_page_count, "max": result.max_page_count},
-        "year": {"min": result.min_year, "max": result.max_year},
-        "rating": {"min": result.min_rating, "max": result.max_rating},
-    }
-
-
-def filter_books(query, filter: BookFilter):
-    if filter.book_type:
-        if filter.book_type == NONE_OPTION:
-            query = query.filter(Book.book_type.is_(None))
-        else:
-            query = query.filter(Book.book_type == filter.book_type)
-    if filter.book_status:
-        if filter.book_status == NONE_OPTION:
-            query = query.filter(Book.status.is_(None))
-        else:
-            query = query.filter(Book.status == filter.book_status)
-
-    if filter.search:
-        # Search books by title, author, ISBN, or year
-        search = filter.search.lower()
-        query = query.filter(
-            or_(
-                # Use ilike for case-insensitive search
-                Book.title.ilike(f"%{search}%"),
-                Author.name.ilike(f"%{search}%"),
-                Book.isbn.ilike(f"%{search}%"),
-                Book.year_published.ilike(f"%{search}%"),
-            )
-        )
-    if filter.author:
-        query = query.filter(Author.name.ilike(f"%{filter.author}%"))
-    if filter.genre:
-        if filter.genre == NONE_OPTION:
-            query = query.filter(Book.genre.is_(None))
-        else:
-            query = query.filter(Book.genre.ilike(f"%{filter.genre}%"))
-    if filter.language:
-        if filter.language == NONE_OPTION:
-            query = query.filter(Book.language.is_(None))
-        else:
-            query = query.filter(Book.language.ilike(f"%{filter.language}%"))
-    if filter.series:
-        if filter.series == NONE_OPTION:
-            query = query.filter(Book.series.is_(None))
-        else:
-            query = query.filter(Book.series.ilike(f"%{filter.series}%"))
-    # rating, pages, year
-    if filter.rating_min:
-        query = query.filter(Book.rating >= filter.rating_min)
-    if filter.rating_max:
-        query = query.filter(Book.rating <= filter.rating_max)
-    if filter.pages_min:
-        query = query.filter(Book.page_count >= filter.pages_min)
-    if filter.pages_max:
-        query = query.filter(Book.page_count <= filter.pages_max)
-    if filter.year_min:
-        query = query.filter(Book.year_published >= filter.year_min)
-    if filter.year_max:
-        query = query.filter(Book.year_published <= filter.year_max)
-    if filter.collection:
-        # Filter by collection
-        query = query.join(Book.collections).filter(Book.collections.any(id=filter.collection))
-    if filter.book_ids:
-        # Filter by book IDs
-        book_ids = [int(id) for id in filter.book_ids.split(",")]
-        query = query.filter(Book.id.in_(book_ids))
-
-    return query
-
-
 @books_bp.route("/api")  # Use a separate route for the API
+@conditional_get(library_etag)
+@cached_response
 def list_books_json():
     # Parameters
-    book_type = request.args.get("type")
-    book_status = request.args.get("status")
     if "page_size" in request.args:
         page_size = int(request.args.get("page_size"))
     else:
@@ -269,42 +98,15 @@ def list_books_json():
         page = int(request.args.get("page"))
     else:
         page = 1
-    search = request.args.get("search")
-    author = request.args.get("author")
-    genre = request.args.get("genre")
-    language = request.args.get("language")
-    series = request.args.get("series")
-    pages_min = request.args.get("pages_min")
-    pages_max = request.args.get("pages_max")
-    year_min = request.args.get("year_min")
-    year_max = request.args.get("year_max")
-    rating_min = request.args.get("rating_min")
-    rating_max = request.args.get("rating_max")
+    # keyset pagination - pass an empty cursor for the first page, then next_cursor from the response
+    cursor = request.args.get("cursor")
     sort_ascending = request.args.get("sort_ascending")
     sort_column = request.args.get("sort_column")
     if not sort_column:
         sort_column = 'title'
     if sort_column == 'title':
         sort_column = 'sortable_title' 
-    collection = request.args.get("collection")
-    book_ids = request.args.get("book_ids", None)
-    filter = BookFilter(
-        search=search,
-        book_type=book_type,
-        book_status=book_status,
-        author=author,
-        genre=genre,
-        language=language,
-        series=series,
-        rating_min=rating_min,
-        rating_max=rating_max,
-        pages_min=pages_min,
-        pages_max=pages_max,
-        year_min=year_min,
-        year_max=year_max,
-        collection=collection,
-        book_ids=book_ids,
-    )
+    filter = book_filter_from_args(request.args)
 
     # skip some columns
     book_columns = [
@@ -321,84 +123,98 @@ def list_books_json():
         "language",
         "publisher",
         "isbn",
-        "series"
+        "series",
+        "author_name",
+        "author_surname_first",
     ]
-    author_columns = ["name", "surname_first"]
+    try:
+        serializer = get_serializer(Book, parse_fields(request.args.get("fields")) or book_columns)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     query = Book.query.join(Author)
     sort_column_sqlalchemy = getattr(Book, sort_column, None)
     if sort_column in ['surname_first']:
         sort_column_sqlalchemy = getattr(Author, sort_column, None)
-    if sort_ascending == "true":
-        query = query.order_by(sort_column_sqlalchemy)
+    ascending = sort_ascending == "true"
+    # Book.id is the tiebreaker so the order is stable for both page and cursor pagination
+    if ascending:
+        query = query.order_by(sort_column_sqlalchemy, Book.id)
     else:
-        query = query.order_by(sort_column_sqlalchemy.desc())
+        query = query.order_by(sort_column_sqlalchemy.desc(), Book.id.desc())
     # filter by book type and status
     query = filter_books(query, filter)
 
-    # just the first 'count' books
-    offset = page_size * (page - 1)
-    query = query.offset(offset).limit(page_size)
-    # Execute the query
-    results = db.session.execute(query).all()
+    if cursor:
+        # continue after the last book of the previous page
+        try:
+            last_value, last_id = decode_cursor(cursor, sort_column, ascending)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = apply_keyset(query, sort_column_sqlalchemy, ascending, last_value, last_id)
+    elif cursor is None:
+        # just the first 'count' books
+        offset = page_size * (page - 1)
+        query = query.offset(offset)
+    query = query.limit(page_size)
+    # Execute the query - just the serialized columns, plus the sort value and id for the cursor
+    query = serializer.project(query).add_columns(sort_column_sqlalchemy, Book.id)
+    results = query.all()
 
     # Convert results to dictionaries
-    all_books = []
-    for row in results:
-        book = row.Book
-        data = {col: getattr(book, col) for col in book_columns}
-        author = book.author
-        for acol in author_columns:
-            data[f"author_{acol}"] = getattr(author, acol, None)
-        all_books.append(data)
+    all_books = [serializer.serialize_row(row) for row in results]
+
+    # a full page means there may be more books after it
+    next_cursor = None
+    if results and len(results) == page_size:
+        *_, last_value, last_id = results[-1]
+        next_cursor = encode_cursor(sort_column, ascending, last_value, last_id)
 
-    # get the min/max value for page count, year, rating
-    minmax = get_min_max_values(db.session, filter)
-    genres = get_genres(db.session, filter)
-    languages = get_langages(db.session, filter)
-    series = get_series(db.session, filter)
-    count = get_count(db.session, filter)
+    # count, min/max values for page count, year, rating and the facet values in one query
+    facets = get_facets(db.session, filter)
 
     # Add a cover image URL for each book
     add_cover_images(all_books)
     add_cover_images_tiny(all_books)
     result = {
         "books": all_books,
-        "minmax": minmax,
-        "genres": genres,
-        "languages": languages,
-        "series": series,
-        "count": count,
+        "minmax": facets["minmax"],
+        "genres": facets["genres"],
+        "tags": facets["tags"],
+        "languages": facets["languages"],
+        "series": facets["series"],
+        "count": facets["count"],
+        "facet_counts": facets["facet_counts"],
+        "next_cursor": next_cursor,
     }
 
     return jsonify(result), 200
 
 
 @books_bp.route("/search_api")
+@conditional_get(library_etag)
 def search_books_api():
     query = request.args.get("search_query")
     series = request.args.get("series")
+    try:
+        serializer = get_serializer(Book, parse_fields(request.args.get("fields")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     if query:
-        # Search books by title, author, ISBN, or year or genre
-        books = (
-            Book.query.join(Author)
-            .filter(
-                or_(
-                    # Use ilike for case-insensitive search
-                    Book.title.ilike(f"%{query}%"),
-                    Author.name.ilike(f"%{query}%"),
-                    Book.isbn.ilike(f"%{query}%"),
-                    Book.year_published.ilike(f"%{query}%"),
-                    Book.genre.ilike(f"%{query}%"),
-                )
-            )
-            .order_by(Book.title)
-            .all()
-        )
+        # Search books by title, author, series, ISBN, year, genre, tags or synopsis - best matches first
+        books, rank = search_ranked(Book.query.join(Author), query)
+        if rank is not None:
+            books = books.order_by(rank, Book.title)
+        else:
+            books = books.order_by(Book.title)
     elif series:
-        books = Book.query.join(Author).filter(Book.series.ilike(f"%{series}%")).order_by(Book.title).all()
+        books = Book.query.join(Author).filter(Book.series.ilike(f"%{series}%")).order_by(Book.title)
     else:
-        books = Book.query.join(Author).order_by(Book.title).all()
-    book_list = [book.as_dict() for book in books]
+        books = Book.query.join(Author).order_by(Book.title)
+    # select just the serialized columns, the author name comes from the join
+    books = serializer.project(books)
+    if wants_stream():
+        return stream_rows(books, serializer, add_cover_images)
+    book_list = [serializer.serialize_row(row) for row in books.all()]
     add_cover_images(book_list)
 
     return jsonify(book_list), 200
@@ -445,14 +261,21 @@ def add_book_api():
 
 
 @books_bp.route("/api/byid", methods=["GET"])
+@conditional_get(library_etag)
 def list_books_by_ids():
     ids_to_filter = request.args.get("ids", "")
 
     if ids_to_filter:
         # Filter books by IDs
         ids_to_filter = [int(id) for id in ids_to_filter.split(",")]
-        existing_books = Book.query.filter(Book.id.in_(ids_to_filter)).all()
-        return jsonify([book.as_dict() for book in existing_books])
+        try:
+            serializer = get_serializer(Book, parse_fields(request.args.get("fields")))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        existing_books = serializer.project(Book.query.join(Author).filter(Book.id.in_(ids_to_filter)))
+        if wants_stream():
+            return stream_rows(existing_books, serializer)
+        return jsonify([serializer.serialize_row(row) for row in existing_books.all()])
     else:
         return jsonify([])  # no IDs provided
 
@@ -464,18 +287,17 @@ def delete_books_api():
     book_ids = data.get("book_ids", [])
     if not book_ids:
         return jsonify({"error": "No book IDs provided"}), 400
-    # Loop through the book IDs and update each book
-    for book_id in book_ids:
-        # Find the book by ID
-        book = Book.query.get(book_id)
-        if not book:
-            return jsonify({"error": f"Book with ID {book_id} not found"}), 404
-        # Delete the book
-        db.session.delete(book)
-    # Commit the changes to the database
+    ids, results = parse_book_ids(book_ids)
+    # delete all books in batches with IN, in a single transaction
+    results.update(bulk_delete_books(ids))
     db.session.commit()
-    return jsonify({"status": "success", "message": "Books deleted successfully"}), 200
-    
+    deleted = sum(1 for status in results.values() if status == STATUS_DELETED)
+    return jsonify({
+        "status": "success" if deleted == len(results) else "partial",
+        "message": f"Deleted {deleted} of {len(results)} books",
+        "results": results_list(results),
+    }), 200
+
 
 @books_bp.route("/update_books_api", methods=["POST"])
 def update_books_api():
@@ -489,27 +311,28 @@ def update_books_api():
     items = data.get("data", [])
     if not items:
         return jsonify({"error": "No data provided"}), 400
-    # Loop through the book IDs and update each book
-    for book_id in book_ids:
-        # Find the book by ID
-        book = Book.query.get(book_id)
-        if not book:
-            return jsonify({"error": f"Book with ID {book_id} not found"}), 404
-
-        # Update the book's attributes
-        for key, value in items.items():
-            setattr(book, key, value)
-
-        # update author
-        if "author_name" in items:
-            author = get_author_by_name(items['author_name'].strip())
-            book.author = author
-
-
-        # Commit the changes to the database
-        db.session.commit()
-
-    return jsonify({"status": "success", "message": "Books updated successfully"}), 200
+    if not isinstance(items, dict):
+        return jsonify({"error": "Data must be an object of field names and values"}), 400
+    values, ignored = updatable_values(items)
+    if "title" in values and not values["title"]:
+        return jsonify({"error": "Title cannot be empty"}), 400
+    # update author - the same author for all books, resolved once
+    if items.get("author_name"):
+        values["author_id"] = author_resolver.get_id(items['author_name'].strip())
+    if not values:
+        return jsonify({"error": "No updatable fields provided", "ignored_fields": ignored}), 400
+
+    ids, results = parse_book_ids(book_ids)
+    # one UPDATE with IN per batch, committed once
+    results.update(bulk_update_books(ids, values))
+    db.session.commit()
+    updated = sum(1 for status in results.values() if status == STATUS_UPDATED)
+    return jsonify({
+        "status": "success" if updated == len(results) else "partial",
+        "message": f"Updated {updated} of {len(results)} books",
+        "results": results_list(results),
+        "ignored_fields": ignored,
+    }), 200
 
 @books_bp.route("/match_books_api", methods=["POST"])
 def match_books():
@@ -0,0 +1,110 @@
+from sqlalchemy import delete, select, update
+from files.uploads import discard_book_uploads
+from genres.genres_db import replace_book_terms
+from models import BOOK_TERM_FIELDS, Book, book_collection, compute_sortable_title, db, refresh_match_keys
+
+# Set-based bulk writes for the book list.
+# Every batch is one SELECT for the existing ids plus one UPDATE/DELETE with IN, the caller commits once.
+# These statements bypass the ORM, so the work of the ORM events (sortable title, term links, match keys) is done here.
+
+BULK_BATCH_SIZE = 500
+
+# columns that are maintained by the application and cannot be set in a bulk update
+READONLY_COLUMNS = {'id', 'author_id', 'sortable_title', 'match_key', 'created_at', 'updated_at'}
+
+STATUS_UPDATED = 'updated'
+STATUS_DELETED = 'deleted'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_INVALID = 'invalid'
+
+
+def batches(items, size=BULK_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_book_ids(book_ids):
+    """
+    Split the requested ids into valid integer ids and per-id results for the invalid ones.
+    """
+    ids = []
+    results = {}
+    for book_id in book_ids:
+        try:
+            ids.append(int(book_id))
+        except (TypeError, ValueError):
+            results[book_id] = STATUS_INVALID
+    return list(dict.fromkeys(ids)), results
+
+
+def updatable_values(items):
+    """
+    Split the update data into column values and ignored keys (not columns or read-only).
+    """
+    columns = {c.key for c in Book.__table__.columns} - READONLY_COLUMNS
+    values = {key: value for key, value in items.items() if key in columns}
+    ignored = [key for key in items if key not in columns and key != 'author_name']
+    return values, ignored
+
+
+def existing_book_ids(ids):
+    return set(db.session.execute(select(Book.id).where(Book.id.in_(ids))).scalars())
+
+
+def bulk_update_books(book_ids, values):
+    """
+    Update the same values on many books.
+
+    :param book_ids: list of integer ids
+    :param values: column -> value, author_id may be included
+    :return: id -> status
+    """
+    values = dict(values)
+    if values.get('title'):
+        values['sortable_title'] = compute_sortable_title(values['title'])
+    term_fields = [field for field in BOOK_TERM_FIELDS if field in values]
+    results = {}
+    for batch in batches(book_ids):
+        found = existing_book_ids(batch)
+        if found:
+            db.session.execute(
+                update(Book).where(Book.id.in_(found)).values(values),
+                execution_options={'synchronize_session': False},
+            )
+            for field in term_fields:
+                replace_book_terms(list(found), field, values[field])
+            if 'title' in values or 'author_id' in values:
+                refresh_match_keys(db.session.connection(), Book, Book.id.in_(found))
+        for book_id in batch:
+            results[book_id] = STATUS_UPDATED if book_id in found else STATUS_NOT_FOUND
+    return results
+
+
+def bulk_delete_books(book_ids):
+    """
+    Delete many books together with their collection, genre, tag and language links and pending uploads.
+
+    :param book_ids: list of integer ids
+    :return: id -> status
+    """
+    link_tables = [book_collection] + [
+        Book.__mapper__.relationships[relationship].secondary for relationship, _ in BOOK_TERM_FIELDS.values()
+    ]
+    results = {}
+    for batch in batches(book_ids):
+        found = existing_book_ids(batch)
+        if found:
+            discard_book_uploads(list(found))
+            for table in link_tables:
+                db.session.execute(delete(table).where(table.c.book_id.in_(found)))
+            db.session.execute(
+                delete(Book).where(Book.id.in_(found)),
+                execution_options={'synchronize_session': False},
+            )
+        for book_id in batch:
+            results[book_id] = STATUS_DELETED if book_id in found else STATUS_NOT_FOUND
+    return results
+
+
+def results_list(results):
+    return [{'id': book_id, 'status': status} for book_id, status in results.items()]
@@ -0,0 +1,117 @@
+from sqlalchemy import func, literal, null, select, union_all
+from books.filters import BookFilter, filter_books
+from models import Author, Book, Genre, Language, Tag, book_genre, book_language, book_tag
+
+FACET_STATS = "stats"
+FACET_GENRE = "genre"
+FACET_TAG = "tag"
+FACET_LANGUAGE = "language"
+FACET_SERIES = "series"
+
+
+def _facet_select(facet, value_column, source):
+    """
+    Build one branch of the facet statement: distinct values of a column with their book count.
+    The min/max columns are padded with NULLs so the branches can be combined with UNION ALL.
+    """
+    return (
+        select(
+            literal(facet).label("facet"),
+            value_column.label("value"),
+            func.count().label("count"),
+            null().label("min_page_count"),
+            null().label("max_page_count"),
+            null().label("min_year"),
+            null().label("max_year"),
+            null().label("min_rating"),
+            null().label("max_rating"),
+        )
+        .select_from(source)
+        .where(value_column.isnot(None))
+        .group_by(value_column)
+    )
+
+
+def _term_facet_select(facet, association_table, model, filtered):
+    """
+    Facet branch for genres, tags and languages, joined through their association table.
+    """
+    term_column = association_table.c[f"{model.__tablename__}_id"]
+    source = filtered.join(association_table, association_table.c.book_id == filtered.c.id).join(
+        model, model.id == term_column
+    )
+    return _facet_select(facet, model.name, source)
+
+
+def get_facets(session, filters: BookFilter):
+    """
+    Get the book count, min/max values and facet values (genres, tags, languages, series) based on filters.
+
+    The filtered books are defined once as a CTE and every aggregate is computed from it
+    in a single UNION ALL statement, instead of running a separate filtered query per facet.
+
+    :param session: SQLAlchemy session
+    :param filters: BookFilter with the active filters
+    :return: A dictionary with count, minmax, genres, tags, languages, series and facet_counts
+    """
+    query = session.query(
+        Book.id,
+        Book.series,
+        Book.page_count,
+        Book.year_published,
+        Book.rating,
+    ).join(Author)
+    query = filter_books(query, filters)
+    filtered = query.cte("filtered")
+
+    stats = select(
+        literal(FACET_STATS).label("facet"),
+        null().label("value"),
+        func.count().label("count"),
+        func.min(filtered.c.page_count).label("min_page_count"),
+        func.max(filtered.c.page_count).label("max_page_count"),
+        func.min(filtered.c.year_published).label("min_year"),
+        func.max(filtered.c.year_published).label("max_year"),
+        func.min(filtered.c.rating).label("min_rating"),
+        func.max(filtered.c.rating).label("max_rating"),
+    ).select_from(filtered)
+    statement = union_all(
+        stats,
+        _term_facet_select(FACET_GENRE, book_genre, Genre, filtered),
+        _term_facet_select(FACET_TAG, book_tag, Tag, filtered),
+        _term_facet_select(FACET_LANGUAGE, book_language, Language, filtered),
+        _facet_select(FACET_SERIES, filtered.c.series, filtered),
+    )
+
+    count = 0
+    minmax = None
+    facet_counts = {FACET_GENRE: {}, FACET_TAG: {}, FACET_LANGUAGE: {}, FACET_SERIES: {}}
+    for row in session.execute(statement):
+        if row.facet == FACET_STATS:
+            count = row.count
+            minmax = {
+                "page_count": {"min": row.min_page_count, "max": row.max_page_count},
+                "year": {"min": row.min_year, "max": row.max_year},
+                "rating": {"min": row.min_rating, "max": row.max_rating},
+            }
+        else:
+            facet_counts[row.facet][row.value] = row.count
+
+    genre_counts = dict(sorted(facet_counts[FACET_GENRE].items()))
+    tag_counts = dict(sorted(facet_counts[FACET_TAG].items()))
+    language_counts = dict(sorted(facet_counts[FACET_LANGUAGE].items()))
+    series_counts = dict(sorted(facet_counts[FACET_SERIES].items()))
+    return {
+        "count": count,
+        "minmax": minmax,
+        "genres": list(genre_counts),
+        "tags": list(tag_counts),
+        "languages": list(language_counts),
+        "series": list(series_counts),
+        "facet_counts": {
+            "genres": genre_counts,
+            "tags": tag_counts,
+            "languages": language_counts,
+            "series": series_counts,
+        },
+    }
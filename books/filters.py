@@ -1,10 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from sqlalchemy import func, select
+from books.fulltext import filter_fulltext
+from books.search_options import NONE_OPTION
+from models import Author, Book, Genre, Language, Tag, book_genre, book_language, book_tag
 
 @dataclass
 class BookFilter:
     search: str = None
     author: str = None
     genre: str = None
+    tag: str = None
     series: str = None
     book_type: str = None
     book_status: str = None
@@ -16,4 +21,97 @@ class BookFilter:
     rating_max: float = None
     language: str = None
     collection: int = None
-    book_ids: str = None # Comma-separated list of book IDs
\ No newline at end of file
+    book_ids: str = None # Comma-separated list of book IDs
+
+# request argument -> BookFilter field, where the names differ
+FILTER_ARGS = {
+    "type": "book_type",
+    "status": "book_status",
+}
+
+
+def book_filter_from_args(args):
+    """
+    Build a BookFilter from request arguments, empty values are treated as not set.
+    """
+    values = {}
+    for field in fields(BookFilter):
+        arg = next((a for a, f in FILTER_ARGS.items() if f == field.name), field.name)
+        value = args.get(arg)
+        if value:
+            values[field.name] = value
+    return BookFilter(**values)
+
+
+def books_with_term(association_table, model, name):
+    """
+    Select the ids of books linked to the Genre/Tag/Language with the given name, ignoring case.
+    """
+    term_column = association_table.c[f"{model.__tablename__}_id"]
+    return (
+        select(association_table.c.book_id)
+        .join(model, model.id == term_column)
+        .where(func.lower(model.name) == name.lower())
+    )
+
+
+def filter_books(query, filter: BookFilter):
+    if filter.book_type:
+        if filter.book_type == NONE_OPTION:
+            query = query.filter(Book.book_type.is_(None))
+        else:
+            query = query.filter(Book.book_type == filter.book_type)
+    if filter.book_status:
+        if filter.book_status == NONE_OPTION:
+            query = query.filter(Book.status.is_(None))
+        else:
+            query = query.filter(Book.status == filter.book_status)
+
+    if filter.search:
+        # Search books by title, author, series, ISBN, year, genre, tags or synopsis
+        query = filter_fulltext(query, filter.search)
+    if filter.author:
+        query = query.filter(Author.name.ilike(f"%{filter.author}%"))
+    # genre, tag and language match whole names through the indexed association tables
+    if filter.genre:
+        if filter.genre == NONE_OPTION:
+            query = query.filter(~Book.genre_items.any())
+        else:
+            query = query.filter(Book.id.in_(books_with_term(book_genre, Genre, filter.genre)))
+    if filter.tag:
+        if filter.tag == NONE_OPTION:
+            query = query.filter(~Book.tag_items.any())
+        else:
+            query = query.filter(Book.id.in_(books_with_term(book_tag, Tag, filter.tag)))
+    if filter.language:
+        if filter.language == NONE_OPTION:
+            query = query.filter(~Book.language_items.any())
+        else:
+            query = query.filter(Book.id.in_(books_with_term(book_language, Language, filter.language)))
+    if filter.series:
+        if filter.series == NONE_OPTION:
+            query = query.filter(Book.series.is_(None))
+        else:
+            query = query.filter(Book.series.ilike(f"%{filter.series}%"))
+    # rating, pages, year
+    if filter.rating_min:
+        query = query.filter(Book.rating >= filter.rating_min)
+    if filter.rating_max:
+        query = query.filter(Book.rating <= filter.rating_max)
+    if filter.pages_min:
+        query = query.filter(Book.page_count >= filter.pages_min)
+    if filter.pages_max:
+        query = query.filter(Book.page_count <= filter.pages_max)
+    if filter.year_min:
+        query = query.filter(Book.year_published >= filter.year_min)
+    if filter.year_max:
+        query = query.filter(Book.year_published <= filter.year_max)
+    if filter.collection:
+        # Filter by collection
+        query = query.join(Book.collections).filter(Book.collections.any(id=filter.collection))
+    if filter.book_ids:
+        # Filter by book IDs
+        book_ids = [int(id) for id in filter.book_ids.split(",")]
+        query = query.filter(Book.id.in_(book_ids))
+
+    return query
@@ -0,0 +1,239 @@
+import re
+from sqlalchemy import and_, column, func, inspect, or_, select, table, text
+from sqlalchemy.dialects.mysql import match
+from models import Author, Book, db
+
+# Full-text search over the library.
+# SQLite: an FTS5 table book_fts (rowid = book.id), kept in sync by triggers on book and author.
+# MariaDB/MySQL: FULLTEXT indexes on book and author, queried with MATCH ... AGAINST.
+# Without either (e.g. SQLite built without FTS5) the search falls back to LIKE.
+
+BACKEND_FTS5 = 'fts5'
+BACKEND_FULLTEXT = 'fulltext'
+
+FTS_TABLE = 'book_fts'
+# indexed columns and their bm25 weights, a match in the title counts the most
+FTS_COLUMNS = {
+    'title': 10.0,
+    'author': 8.0,
+    'series': 5.0,
+    'isbn': 5.0,
+    'year': 2.0,
+    'genre': 2.0,
+    'tags': 2.0,
+    'synopsis': 1.0,
+}
+BOOK_FULLTEXT_COLUMNS = ['title', 'series', 'isbn', 'genre', 'tags', 'synopsis']
+# InnoDB does not index its default stopwords and words shorter than innodb_ft_min_token_size
+INNODB_STOPWORDS = frozenset(
+    'a about an are as at be by com de en for from how i in is it la of on or that the this to was what when '
+    'where who will with und www'.split()
+)
+INNODB_MIN_TOKEN_SIZE = 3  # default of innodb_ft_min_token_size
+
+book_fts = table(FTS_TABLE, column('rowid'), column(FTS_TABLE))
+
+# the values indexed for a book row, used by the triggers and the rebuild
+_FTS_VALUES = '''{row}.title,
+    (SELECT author.name FROM author WHERE author.id = {row}.author_id),
+    {row}.series, {row}.isbn, CAST({row}.year_published AS TEXT), {row}.genre, {row}.tags, {row}.synopsis'''
+
+_FTS_INSERT = f'''INSERT INTO {FTS_TABLE}(rowid, {", ".join(FTS_COLUMNS)})
+    VALUES (new.id, {_FTS_VALUES.format(row="new")});'''
+
+FTS5_DDL = [
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    {", ".join(FTS_COLUMNS)},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_fts_insert AFTER INSERT ON book BEGIN
+    {_FTS_INSERT}
+END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_fts_update
+AFTER UPDATE OF title, author_id, series, isbn, year_published, genre, tags, synopsis ON book BEGIN
+    DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    {_FTS_INSERT}
+END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_fts_delete AFTER DELETE ON book BEGIN
+    DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_fts_author_update AFTER UPDATE OF name ON author BEGIN
+    UPDATE {FTS_TABLE} SET author = new.name WHERE rowid IN (SELECT id FROM book WHERE author_id = new.id);
+END''',
+]
+
+FULLTEXT_INDEXES = {
+    'book': ('ft_book', BOOK_FULLTEXT_COLUMNS),
+    'author': ('ft_author', ['name']),
+}
+
+_backend_cache = {}
+_min_token_size_cache = {}
+
+
+def create_fulltext_index():
+    """
+    Create the full-text index for the current database and index all existing books.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        try:
+            for statement in FTS5_DDL:
+                db.session.execute(text(statement))
+        except Exception as e:
+            print(f"FTS5 is not available, library search will use LIKE: {e}")
+            db.session.rollback()
+            return
+        rebuild_fulltext_index()
+    elif dialect in ('mysql', 'mariadb'):
+        inspector = inspect(db.engine)
+        for table_name, (index_name, columns) in FULLTEXT_INDEXES.items():
+            existing = {index['name'] for index in inspector.get_indexes(table_name)}
+            if index_name not in existing:
+                db.session.execute(text(f'CREATE FULLTEXT INDEX {index_name} ON {table_name} ({", ".join(columns)})'))
+    db.session.commit()
+    _backend_cache.clear()
+
+
+def rebuild_fulltext_index():
+    """
+    Re-index all books in the FTS5 table.
+    """
+    db.session.execute(text(f'DELETE FROM {FTS_TABLE}'))
+    db.session.execute(text(
+        f'''INSERT INTO {FTS_TABLE}(rowid, {", ".join(FTS_COLUMNS)})
+        SELECT book.id, {_FTS_VALUES.format(row="book")} FROM book'''
+    ))
+
+
+def get_fulltext_backend():
+    """
+    Return BACKEND_FTS5, BACKEND_FULLTEXT or None if the database has no full-text index.
+    """
+    url = str(db.engine.url)
+    if url not in _backend_cache:
+        dialect = db.engine.dialect.name
+        inspector = inspect(db.engine)
+        backend = None
+        if dialect == 'sqlite' and inspector.has_table(FTS_TABLE):
+            backend = BACKEND_FTS5
+        elif dialect in ('mysql', 'mariadb'):
+            indexes = {index['name'] for index in inspector.get_indexes('book')}
+            if FULLTEXT_INDEXES['book'][0] in indexes:
+                backend = BACKEND_FULLTEXT
+        _backend_cache[url] = backend
+    return _backend_cache[url]
+
+
+def get_min_token_size():
+    """
+    Return innodb_ft_min_token_size of the MariaDB/MySQL server, shorter words are not in the index.
+    """
+    url = str(db.engine.url)
+    if url not in _min_token_size_cache:
+        try:
+            with db.engine.connect() as connection:
+                size = connection.execute(text('SELECT @@innodb_ft_min_token_size')).scalar()
+        except Exception as e:
+            print(f"Cannot read innodb_ft_min_token_size, using {INNODB_MIN_TOKEN_SIZE}: {e}")
+            size = None
+        _min_token_size_cache[url] = int(size) if size is not None else INNODB_MIN_TOKEN_SIZE
+    return _min_token_size_cache[url]
+
+
+def indexed_terms(terms):
+    # words MATCH ... AGAINST can find, a stopword or a short word like "of" never matches
+    min_size = get_min_token_size()
+    return [term for term in terms if len(term) >= min_size and term.lower() not in INNODB_STOPWORDS]
+
+
+def search_terms(search):
+    return re.findall(r'\w+', search or '')
+
+
+def fts5_query(search):
+    # every word has to match, as a prefix, so "drag ki" finds "The Dragon King"
+    return ' '.join(f'"{term}"*' for term in search_terms(search))
+
+
+def boolean_mode_query(terms):
+    # prefix terms without the + operator, each term adds to the relevance
+    return ' '.join(f'{term}*' for term in terms)
+
+
+def like_condition(search):
+    search = search.lower()
+    return or_(
+        # Use ilike for case-insensitive search
+        Book.title.ilike(f"%{search}%"),
+        Author.name.ilike(f"%{search}%"),
+        Book.isbn.ilike(f"%{search}%"),
+        Book.year_published.ilike(f"%{search}%"),
+        Book.genre.ilike(f"%{search}%"),
+    )
+
+
+def _book_match(against):
+    return match(*[getattr(Book, c) for c in BOOK_FULLTEXT_COLUMNS], against=against).in_boolean_mode()
+
+
+def _author_match(against):
+    return match(Author.name, against=against).in_boolean_mode()
+
+
+def _mysql_match(search):
+    """
+    :return: tuple of (condition, relevance score - higher is better),
+        None if no word of the search is in the full-text index
+    """
+    terms = indexed_terms(search_terms(search))
+    if not terms:
+        return None
+    # the book columns and the author name are separate full-text indexes, every word has to match
+    # one of them, so "tolkien hobbit" finds the book by its author and title
+    condition = and_(*[
+        or_(_book_match(f'{term}*'), _author_match(f'{term}*')) for term in terms
+    ])
+    against = boolean_mode_query(terms)
+    return condition, _book_match(against) + _author_match(against)
+
+
+def filter_fulltext(query, search):
+    """
+    Filter a query joined with Author to the books matching the search text.
+    """
+    backend = get_fulltext_backend()
+    if not search_terms(search) or backend is None:
+        return query.filter(like_condition(search))
+    if backend == BACKEND_FTS5:
+        matching_ids = select(book_fts.c.rowid).where(book_fts.c[FTS_TABLE].op('MATCH')(fts5_query(search)))
+        return query.filter(Book.id.in_(matching_ids))
+    matched = _mysql_match(search)
+    if matched is None:
+        return query.filter(like_condition(search))
+    condition, _ = matched
+    return query.filter(condition)
+
+
+def search_ranked(query, search):
+    """
+    Filter a query joined with Author to the books matching the search text and rank them.
+
+    :return: tuple of (query, rank expression - lower is better, or None without a full-text index)
+    """
+    backend = get_fulltext_backend()
+    if not search_terms(search) or backend is None:
+        return query.filter(like_condition(search)), None
+    if backend == BACKEND_FTS5:
+        rank = func.bm25(book_fts.c[FTS_TABLE], *FTS_COLUMNS.values())
+        query = (
+            query.join(book_fts, book_fts.c.rowid == Book.id)
+            .filter(book_fts.c[FTS_TABLE].op('MATCH')(fts5_query(search)))
+        )
+        return query, rank
+    matched = _mysql_match(search)
+    if matched is None:
+        return query.filter(like_condition(search)), None
+    condition, score = matched
+    return query.filter(condition), -score
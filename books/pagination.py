@@ -0,0 +1,69 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+from models import Book
+
+# Keyset (cursor) pagination for the book list.
+# A cursor stores the sort value and the id of the last book of a page, the next page
+# continues right after that (value, id) pair, so every page costs the same as the first one.
+# NULL sort values sort first in ascending order (SQLite and MariaDB), which the
+# conditions below account for.
+
+
+def encode_cursor(sort_column, ascending, sort_value, book_id):
+    value_type = None
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+        value_type = "datetime"
+    payload = {"c": sort_column, "a": ascending, "v": sort_value, "t": value_type, "id": book_id}
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort_column, ascending):
+    """
+    Decode a cursor created by encode_cursor.
+
+    :param cursor: the opaque cursor string
+    :param sort_column: the active sort column, it has to match the cursor
+    :param ascending: the active sort direction, it has to match the cursor
+    :return: tuple of (sort value, book id)
+    :raises ValueError: if the cursor is malformed or was created for another sort order
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        sort_value = payload["v"]
+        book_id = int(payload["id"])
+        if payload.get("t") == "datetime":
+            sort_value = datetime.fromisoformat(sort_value)
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+    if payload.get("c") != sort_column or payload.get("a") != ascending:
+        raise ValueError("Cursor does not match the sort order")
+    return sort_value, book_id
+
+
+def apply_keyset(query, sort_column_sqlalchemy, ascending, sort_value, book_id):
+    """
+    Filter the query to the books that come after (sort_value, book_id) in the sort order.
+    The query has to be ordered by the sort column and Book.id in the same direction.
+    """
+    column = sort_column_sqlalchemy
+    if ascending:
+        if sort_value is None:
+            condition = or_(and_(column.is_(None), Book.id > book_id), column.isnot(None))
+        else:
+            condition = or_(column > sort_value, and_(column == sort_value, Book.id > book_id))
+    else:
+        if sort_value is None:
+            condition = and_(column.is_(None), Book.id < book_id)
+        else:
+            condition = or_(
+                column < sort_value,
+                and_(column == sort_value, Book.id < book_id),
+                column.is_(None),
+            )
+    return query.filter(condition)
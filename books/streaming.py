@@ -0,0 +1,35 @@
+import json
+from flask import Response, request, stream_with_context
+
+# Streaming (NDJSON) responses for large book lists.
+# Rows are fetched in batches with yield_per and written one JSON document per line as they are
+# produced, so memory stays constant and the first byte goes out right away.
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500
+
+
+def wants_stream():
+    """
+    True if the client asked for a stream, with ?stream=1 or Accept: application/x-ndjson.
+    """
+    if request.args.get("stream") == "1":
+        return True
+    return any(mimetype == NDJSON_MIMETYPE for mimetype, _ in request.accept_mimetypes)
+
+
+def stream_rows(query, serializer, transform=None):
+    """
+    Stream the rows of a projected query as NDJSON.
+
+    :param query: query selecting the serializer columns (see Serializer.project)
+    :param serializer: the Serializer for the rows
+    :param transform: optional function applied to each list of serialized rows (e.g. add_cover_images)
+    """
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            data = serializer.serialize_row(row)
+            if transform:
+                transform([data])
+            yield json.dumps(data) + "\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
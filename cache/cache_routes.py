@@ -0,0 +1,9 @@
+from flask import Blueprint, jsonify
+from cache.response_cache import response_cache
+
+cache_bp = Blueprint('cache', __name__, url_prefix='/cache')
+
+@cache_bp.route('/stats')
+def cache_stats():
+    # hit/miss counts of the response cache, to help sizing it
+    return jsonify(response_cache.stats()), 200
@@ -0,0 +1,48 @@
+import functools
+import hashlib
+import secrets
+from flask import Response, make_response, request
+from cache.response_cache import get_library_version
+
+# Conditional GET support for the JSON read endpoints.
+# Library-wide endpoints use the library version as ETag, single books their row version.
+# The process token keeps ETags from a previous run from matching after a restart.
+
+_process_token = secrets.token_hex(4)
+
+
+def library_etag(**kwargs):
+    return f"lib-{_process_token}-{get_library_version()}"
+
+
+def row_etag(*parts):
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f"row-{digest[:20]}"
+
+
+def conditional_get(etag_for):
+    """
+    Decorator for GET views, answers with 304 Not Modified when If-None-Match matches the ETag.
+
+    :param etag_for: function taking the view arguments and returning the ETag,
+                     or None to skip the check (e.g. the resource does not exist)
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = etag_for(**kwargs)
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.if_none_match.contains(etag):
+                # nothing changed, skip the body queries
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # clients may keep the response, but have to revalidate it
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,156 @@
+import functools
+import threading
+from collections import OrderedDict
+from dataclasses import astuple, fields
+from flask import Response, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from books.filters import FILTER_ARGS, BookFilter, book_filter_from_args
+from models import Author, Book, Collection, book_collection
+
+# Response cache for the read-heavy library endpoints.
+# Cached responses are tagged with the library version they were computed at. Any write to
+# books, authors or collections bumps the version, which turns all older entries into misses.
+# The cache and the version counter are per process.
+
+RESPONSE_CACHE_SIZE = 256
+
+TRACKED_MODELS = (Book, Author, Collection)
+TRACKED_TABLES = {Book.__tablename__, Author.__tablename__, Collection.__tablename__, book_collection.name}
+
+_version_lock = threading.Lock()
+_library_version = 0
+
+
+def get_library_version():
+    return _library_version
+
+
+def bump_library_version():
+    global _library_version
+    with _version_lock:
+        _library_version += 1
+    return _library_version
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of responses, entries computed at an older library version are misses.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "library_version": get_library_version(),
+            }
+
+
+response_cache = ResponseCache()
+
+
+def make_cache_key(endpoint, view_args, args):
+    """
+    Cache key from the endpoint, the URL parameters, the normalized BookFilter and the other query args.
+    """
+    filter_args = set(FILTER_ARGS) | {field.name for field in fields(BookFilter)}
+    other_args = tuple(sorted((k, v) for k, v in args.items(multi=True) if k not in filter_args))
+    return (
+        endpoint,
+        tuple(sorted(view_args.items())),
+        astuple(book_filter_from_args(args)),
+        other_args,
+    )
+
+
+def cached_response(view):
+    """
+    Decorator for GET views, serves the response from the cache while the library is unchanged.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = make_cache_key(request.endpoint, kwargs, request.args)
+        # read the version before computing, so a concurrent write can only make the entry stale
+        version = get_library_version()
+        cached = response_cache.get(key, version)
+        if cached is not None:
+            body, status, mimetype = cached
+            return Response(body, status=status, mimetype=mimetype)
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            response_cache.put(key, version, (response.get_data(), response.status_code, response.mimetype))
+        return response
+    return wrapper
+
+
+def _changes_library(objects):
+    return any(isinstance(obj, TRACKED_MODELS) for obj in objects)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_changes(session, flush_context):
+    if _changes_library(session.new) or _changes_library(session.dirty) or _changes_library(session.deleted):
+        session.info['library_changed'] = True
+        bump_library_version()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    # bulk UPDATE/DELETE/INSERT statements bypass the flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and getattr(table, 'name', None) in TRACKED_TABLES:
+        orm_execute_state.session.info['library_changed'] = True
+        bump_library_version()
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_after_commit(session):
+    # readers may have cached the pre-commit state after the flush, invalidate again
+    if session.info.pop('library_changed', False):
+        bump_library_version()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _bump_after_rollback(session):
+    if session.info.pop('library_changed', False):
+        bump_library_version()
@@ -0,0 +1,27 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# worker processes for import parsing and book metadata extraction
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+
+# on-disk cache of extracted book file metadata, entries unused for this many days are evicted
+METADATA_CACHE_PATH = os.path.abspath(os.getenv('METADATA_CACHE_PATH', 'metadata_cache.db'))
+METADATA_CACHE_MAX_AGE_DAYS = int(os.getenv('METADATA_CACHE_MAX_AGE_DAYS', 90))
+
+# watch folder under the import directory, imported incrementally every WATCH_INTERVAL seconds, disabled if empty
+WATCH_FOLDER = os.getenv('WATCH_FOLDER', '')
+WATCH_INTERVAL = int(os.getenv('WATCH_INTERVAL', 300))
+
+# also write WebP versions of the cover thumbnails
+COVER_WEBP = os.getenv('COVER_WEBP', '').lower() in ('1', 'true', 'yes')
+
+# cover downloader threads, 0 disables the downloader, and the concurrent downloads from one host
+COVER_DOWNLOAD_WORKERS = int(os.getenv('COVER_DOWNLOAD_WORKERS', 8))
+COVER_HOST_CONCURRENCY = int(os.getenv('COVER_HOST_CONCURRENCY', 4))
+
+# let the front proxy send the library files: X-Sendfile (Apache, lighttpd) or X-Accel-Redirect (nginx),
+# for nginx SENDFILE_PREFIX is the internal location that maps to the data directory
+SENDFILE_HEADER = os.getenv('SENDFILE_HEADER', '')
+SENDFILE_PREFIX = os.getenv('SENDFILE_PREFIX', '/internal-books').rstrip('/')
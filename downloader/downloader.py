@@ -1,21 +1,208 @@
-import logging
-from apscheduler.schedulers.background import BackgroundScheduler
-import urllib.request
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, func, select
+from urllib3.util.retry import Retry
+from config import COVER_DOWNLOAD_WORKERS, COVER_HOST_CONCURRENCY
+from models import Book, db
+from thumbnails.thumbnails import COVER_TINY_FILENAME, generate_cover_variants, save_cover_image
+
+# In-process cover downloader.
+# Books with a remote_image_url are claimed in batches by id, their covers are downloaded by a thread pool
+# over one keep-alive session, at most COVER_HOST_CONCURRENCY at a time from the same host.
+# The resized variants of a batch are made in the cover process pool and the books are updated with one statement.
+# When the backlog is empty the downloader waits for COVER_POLL_INTERVAL seconds or until it is woken up.
+
+COVER_BATCH_SIZE = 100
+COVER_POLL_INTERVAL = 60  # seconds
+COVER_TIMEOUT = (5, 30)  # connect and read timeout, seconds
+COVER_RETRY = Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=('GET', ), respect_retry_after_header=True)
+THROUGHPUT_WINDOW = 60  # seconds
+
+
+class BrokenCover(Exception):
+    # the URL will never give a cover, e.g. 404, the book's remote_image_url is cleared
+    pass
+
+
+def create_session(workers=COVER_DOWNLOAD_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=COVER_RETRY)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CoverDownloader:
+    def __init__(self, workers=COVER_DOWNLOAD_WORKERS, host_concurrency=COVER_HOST_CONCURRENCY):
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.session = None
+        self.executor = None
+        self.thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._host_limits = {}
+        self._last_id = 0
+        self._completed = deque()  # times of the recent downloads, for the throughput
+        self.in_flight = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.broken = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, app):
+        with self._lock:
+            if self.running or self.workers < 1:
+                return
+            self.session = create_session(self.workers)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cover-download')
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self._run, args=(app, ), name='cover-downloader', daemon=True)
+            self.thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _host_limit(self, host):
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return self._host_limits[host]
+
+    def _claim_batch(self):
+        # keyset paging by id, failed downloads stay and are tried again on the next pass
+        rows = db.session.execute(
+            select(Book.id, Book.remote_image_url)
+            .where(Book.remote_image_url.isnot(None), Book.id > self._last_id)
+            .order_by(Book.id)
+            .limit(COVER_BATCH_SIZE)
+        ).all()
+        db.session.rollback()  # do not keep the read transaction open during the downloads
+        return rows
+
+    def _download(self, book_id, url):
+        """
+        :return: (book_id, url, outcome), outcome is 'downloaded', 'failed' or 'broken'
+        """
+        host = urlparse(url).hostname
+        if not host:
+            return book_id, url, 'broken'
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with self._host_limit(host):
+                response = self.session.get(url, stream=True, timeout=COVER_TIMEOUT)
+                with response:
+                    if 400 <= response.status_code < 500 and response.status_code != 429:
+                        raise BrokenCover(f'HTTP {response.status_code}')
+                    response.raise_for_status()
+                    save_cover_image(book_id, response)
+            outcome = 'downloaded'
+        except BrokenCover as e:
+            print(f"Broken cover URL of book {book_id}: {url} ({e})")
+            outcome = 'broken'
+        except requests.exceptions.RequestException as e:
+            print(f"Error downloading cover of book {book_id}: {e}")
+            outcome = 'failed'
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        return book_id, url, outcome
+
+    def _write_batch(self, results):
+        downloaded = [(book_id, url) for book_id, url, outcome in results if outcome == 'downloaded']
+        variants = generate_cover_variants([book_id for book_id, _ in downloaded])
+        table = Book.__table__
+        # the url condition leaves books alone whose cover was changed during the download
+        condition = (table.c.id == bindparam('book_id')) & (table.c.remote_image_url == bindparam('url'))
+        if downloaded:
+            db.session.execute(
+                table.update().where(condition).values(
+                    cover_image=bindparam('cover_image'), cover_image_tiny=bindparam('cover_image_tiny'),
+                    remote_image_url=None),
+                [{'book_id': book_id, 'url': url, 'cover_image': 'cover.jpg',
+                  'cover_image_tiny': COVER_TINY_FILENAME if variants.get(book_id) else None}
+                 for book_id, url in downloaded],
+            )
+        broken = [{'book_id': book_id, 'url': url} for book_id, url, outcome in results if outcome == 'broken']
+        if broken:
+            db.session.execute(table.update().where(condition).values(remote_image_url=None), broken)
+        db.session.commit()
+        now = time.time()
+        with self._lock:
+            self.downloaded += len(downloaded)
+            self.broken += len(broken)
+            self.failed += len(results) - len(downloaded) - len(broken)
+            self._completed.extend([now] * len(downloaded))
+        return len(downloaded)
+
+    def _run(self, app):
+        pass_downloaded = 0  # downloads of the current pass over the backlog
+        with app.app_context():
+            while True:
+                try:
+                    batch = self._claim_batch()
+                    if not batch:
+                        if self._last_id == 0 or not pass_downloaded:
+                            # nothing to download, or only failing downloads, wait for new covers
+                            self._wake.wait(COVER_POLL_INTERVAL)
+                            self._wake.clear()
+                        self._last_id = 0
+                        pass_downloaded = 0
+                        continue
+                    self._last_id = batch[-1].id
+                    results = list(self.executor.map(lambda row: self._download(row.id, row.remote_image_url), batch))
+                    pass_downloaded += self._write_batch(results)
+                except Exception as e:
+                    print(f"Cover downloader error: {e}")
+                    db.session.rollback()
+                    time.sleep(COVER_POLL_INTERVAL)
+                finally:
+                    db.session.remove()
+
+    def throughput(self):
+        # covers per second over the last THROUGHPUT_WINDOW seconds
+        cutoff = time.time() - THROUGHPUT_WINDOW
+        with self._lock:
+            while self._completed and self._completed[0] < cutoff:
+                self._completed.popleft()
+            return round(len(self._completed) / THROUGHPUT_WINDOW, 2)
+
+    def status(self):
+        queued = db.session.execute(select(func.count(Book.id)).where(Book.remote_image_url.isnot(None))).scalar()
+        return {
+            'running': self.running,
+            'queued': queued,
+            'in_flight': self.in_flight,
+            'downloaded': self.downloaded,
+            'failed': self.failed,
+            'broken': self.broken,
+            'covers_per_second': self.throughput(),
+            'workers': self.workers,
+            'host_concurrency': self.host_concurrency,
+            'uptime_seconds': round(time.time() - self.started_at) if self.started_at else None,
+        }
+
+
+cover_downloader = CoverDownloader()
 
-def request_cover_download():
-    # just get /download_book_covers url
-    # TODO use Flask to find out the URL
-    urllib.request.urlopen('http://localhost:5000/download_book_covers')
-    return
 
-# declared globally, so we can schedule a jobs with decorators
 def schedule_cover_download(app):
-    # Schedule the download_book_covers function to run every second
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func = request_cover_download,
-                      trigger='interval',
-                      seconds=5, # TODO configure this
-                      id='download_book_covers',)
-    scheduler.start()
-    # Set the logging level for the scheduler to ERROR to avoid too much output
-    logging.getLogger('apscheduler.scheduler').setLevel(logging.ERROR)
\ No newline at end of file
+    # started from a request, like the import jobs, so the reloader process does not download too
+    if not COVER_DOWNLOAD_WORKERS:
+        return
+
+    @app.before_request
+    def start_cover_downloader():
+        if not cover_downloader.running:
+            cover_downloader.start(app)
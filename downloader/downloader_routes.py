@@ -1,24 +1,16 @@
-from flask import Blueprint, jsonify
-from sqlalchemy.orm.exc import NoResultFound
-from thumbnails.thumbnails import download_cover_image
-from models import db, Book
+from flask import Blueprint, current_app, jsonify
+from downloader.downloader import cover_downloader
 
 downloader_bp = Blueprint('downloader', __name__, url_prefix='/download_book_covers')
 
 @downloader_bp.route('/')
 def download_book_covers():
-    # look in the database for books with a remote_image_url, fetch one
-    book = Book.query.filter(Book.remote_image_url.isnot(None)).first()
-    if not book:
-        return jsonify(message="No books with remote_image_url found"), 200
-    url = book.remote_image_url
-    if url == '':
-        # broken remote image url, fix it
-        book.remote_image_url = None
-        db.session.commit()
-        return jsonify(message="Book has no remote_image_url"), 200
-    cover_image = download_cover_image(url)
-    book.cover_image = cover_image
-    book.remote_image_url = None
-    db.session.commit()
-    return jsonify({"message": "Cover image downloaded and saved."}), 200
\ No newline at end of file
+    # start the downloader, or wake it up to look for new remote_image_urls right away
+    if not cover_downloader.running:
+        cover_downloader.start(current_app._get_current_object())
+    cover_downloader.wake()
+    return jsonify(cover_downloader.status()), 200
+
+@downloader_bp.route('/status')
+def cover_download_status():
+    return jsonify(cover_downloader.status()), 200
@@ -0,0 +1,42 @@
+import os
+from flask import Blueprint, abort, request
+from werkzeug.utils import secure_filename
+from files.files import BOOKS_DIR
+from files.sendfile import content_hash, send_library_file, stat_fingerprint
+from thumbnails.thumbnails import COVER_NAME, COVER_VARIANT_FILES, ensure_cover_variant
+
+covers_bp = Blueprint('covers', __name__, url_prefix='/covers')
+
+# Cover images straight from the book folders, without a database query.
+# cover_url() gives URLs with a ?v= fingerprint of the file version, those are cached by browsers for a year.
+# Requests without a current fingerprint are revalidated with the content hash ETag.
+
+
+def is_cover_filename(filename):
+    return filename in COVER_VARIANT_FILES or os.path.splitext(filename)[0] == COVER_NAME
+
+
+def cover_url(book_id, filename):
+    """
+    Fingerprinted URL of a cover file, without the fingerprint if the file is not there (yet).
+    """
+    url = f'/covers/{book_id}/{filename}'
+    try:
+        stat = os.stat(os.path.join(BOOKS_DIR, str(book_id), filename))
+    except OSError:
+        return url
+    return f'{url}?v={stat_fingerprint(stat)}'
+
+
+@covers_bp.route('/<int:book_id>/<filename>')
+def serve_cover(book_id, filename):
+    filename = secure_filename(filename)
+    if not is_cover_filename(filename):
+        abort(404)
+    path = os.path.join(BOOKS_DIR, str(book_id), filename)
+    # variants are made again when missing or outdated
+    if not ensure_cover_variant(book_id, filename) and not os.path.exists(path):
+        abort(404)
+    stat = os.stat(path)
+    immutable = request.args.get('v') == stat_fingerprint(stat)
+    return send_library_file(path, etag=content_hash(path, stat), immutable=immutable)
@@ -1,7 +1,13 @@
-from flask import abort, request, send_from_directory
+from functools import lru_cache
+from flask import abort, request
 from flask import Blueprint, jsonify
+from sqlalchemy import select
+from cache.response_cache import get_library_version
 from files.files import BOOKS_DIR, get_supported_extensions, save_book_file
-from models import Author, Book, db
+from files.sendfile import send_library_file
+from files.uploads import UploadError, create_upload, discard_upload, finalize_upload, upload_dict, write_chunk
+from models import Author, Book, FileUpload, db
+from thumbnails.thumbnails import create_cover_variants, ensure_cover_variant
 import os
 from werkzeug.utils import secure_filename
 
@@ -10,23 +16,37 @@ files_bp = Blueprint('files', __name__, url_prefix='/files')
 # endpoints - upload and download files
 # files can be book files and cover images
 
-@files_bp.route('/<book_id>/<filename>')
+@lru_cache(maxsize=1024)
+def _download_basename(book_id, library_version):
+    row = db.session.execute(
+        select(Author.name, Book.title).join(Book.author).where(Book.id == book_id)
+    ).first()
+    return f"{row.name}-{row.title}" if row else None
+
+def get_download_basename(book_id):
+    # e-readers and resumed downloads request the same file in many ranges, the name is looked up once
+    # per library version, any change of a book or author makes a new version
+    return _download_basename(book_id, get_library_version())
+
+@files_bp.route('/<int:book_id>/<filename>')
 def serve_book_file(book_id, filename):
+    basename = get_download_basename(book_id)
+    if basename is None:
+        abort(404)
     # Sanitize filename to prevent directory traversal
-    book = Book.query.join(Book.author).filter(Book.id == book_id).first_or_404()
     filename = secure_filename(filename)
-    book_folder = os.path.join(BOOKS_DIR, book_id)
-    if not os.path.exists(os.path.join(book_folder, filename)):
+    path = os.path.join(BOOKS_DIR, str(book_id), filename)
+    # cover variants are made again when missing or outdated
+    if not ensure_cover_variant(book_id, filename) and not os.path.isfile(path):
         abort(404)
     # generate a new name of the file
     extension = os.path.splitext(filename)[1]
-    newname = f"{book.author.name}-{book.title}{extension}"
+    newname = f"{basename}{extension}"
     # Sanitize the download name
     newname = secure_filename(newname)
-    return send_from_directory(book_folder,
-                               filename,
-                               as_attachment=True,
-                               download_name=newname)
+    # Range and If-Range requests are answered with 206, the file is sent with the server's sendfile
+    # (wsgi.file_wrapper) or by the front proxy with SENDFILE_HEADER
+    return send_library_file(path, as_attachment=True, download_name=newname)
 
 @files_bp.route('/<int:book_id>/cover', methods=['POST'])
 def upload_cover_image(book_id):
@@ -43,6 +63,7 @@ def upload_cover_image(book_id):
     path = os.path.join(BOOKS_DIR, path)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     cover.save(path)
+    create_cover_variants(book.id)
     filename = os.path.basename(path)
     book.cover_image = filename
     db.session.commit()
@@ -66,4 +87,60 @@ def upload_book_file(book_id):
     filename = os.path.basename(path)
     book.file_path = filename
     db.session.commit()
-    return jsonify({'status': 'success', 'message': 'File uploaded successfully'}), 200
\ No newline at end of file
+    return jsonify({'status': 'success', 'message': 'File uploaded successfully'}), 200
+
+# resumable chunked uploads, see files/uploads.py
+# POST /files/<book_id>/uploads {filename, size} -> upload_id
+# PUT /files/uploads/<upload_id>?offset=<received bytes> with a chunk of the file as the body
+# GET /files/uploads/<upload_id> -> offset to continue an interrupted upload from
+# POST /files/uploads/<upload_id>/finalize {sha256 (optional)} -> the book file is replaced
+
+@files_bp.route('/<int:book_id>/uploads', methods=['POST'])
+def create_book_file_upload(book_id):
+    Book.query.get_or_404(book_id)
+    data = request.get_json(silent=True) or {}
+    if not data.get('filename'):
+        return jsonify({'error': 'No file name'}), 400
+    try:
+        upload = create_upload(book_id, secure_filename(data['filename']), data.get('size'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(upload_dict(upload)), 201
+
+@files_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_book_file_upload(upload_id):
+    upload = FileUpload.query.get_or_404(upload_id)
+    return jsonify(upload_dict(upload)), 200
+
+@files_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def put_book_file_chunk(upload_id):
+    upload = FileUpload.query.get_or_404(upload_id)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'No offset'}), 400
+    try:
+        # the body is streamed to the file, not read into memory
+        received = write_chunk(upload, offset, request.stream)
+    except UploadError as e:
+        return jsonify({'error': str(e), **upload_dict(upload)}), e.status
+    return jsonify({'offset': received, 'size': upload.size}), 200
+
+@files_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_book_file_upload(upload_id):
+    upload = FileUpload.query.get_or_404(upload_id)
+    data = request.get_json(silent=True) or {}
+    book = Book.query.get_or_404(upload.book_id)
+    try:
+        path, sha256 = finalize_upload(upload, data.get('sha256'))
+    except UploadError as e:
+        return jsonify({'error': str(e), **upload_dict(upload)}), e.status
+    book.file_path = os.path.basename(path)
+    db.session.commit()
+    return jsonify({'status': 'success', 'message': 'File uploaded successfully', 'sha256': sha256}), 200
+
+@files_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_book_file_upload(upload_id):
+    upload = FileUpload.query.get_or_404(upload_id)
+    discard_upload(upload)
+    db.session.commit()
+    return jsonify({'status': 'success', 'message': 'Upload cancelled'}), 200
@@ -1,22 +1,93 @@
+import errno
 import os
+import shutil
+import tempfile
 from models import Book, db
 
+try:
+    import fcntl
+except ImportError:
+    # no reflinks on Windows
+    fcntl = None
+
 BOOKS_DIR = os.path.abspath("data")
 os.makedirs(BOOKS_DIR, exist_ok=True)
 
 BOOK_FILENAME = 'book'
+COPY_BUFFER_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # ioctl of linux/fs.h, copy-on-write clone of a file on btrfs, xfs and others
 
 def get_supported_extensions():
     # Returns a list of supported file extensions
     return ['.pdf', '.epub', '.mobi', '.txt', '.azw3', '.htm', '.html', '.pdb', '.djvu', '.fb2']
 
-def save_book_file(book_id, file_obj, original_filename, supported_extensions):
+def book_file_path(book_id, original_filename, supported_extensions):
     file_extension = os.path.splitext(original_filename)[1].lower()
     if file_extension not in supported_extensions:
         raise ValueError(f'Unsupported file type: {file_extension}')
     path = f'{book_id}/{BOOK_FILENAME}{file_extension}'
-    path = os.path.join(BOOKS_DIR, path)
+    return os.path.join(BOOKS_DIR, path)
+
+def save_book_file(book_id, file_obj, original_filename, supported_extensions):
+    path = book_file_path(book_id, original_filename, supported_extensions)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     file_obj.seek(0)
-    file_obj.save(path) if hasattr(file_obj, 'save') else open(path, 'wb').write(file_obj.read())
-    return path
\ No newline at end of file
+    # copied in chunks to a temporary file of its own, a failed or concurrent upload never
+    # replaces the book file with partial data
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(file_obj, f, COPY_BUFFER_SIZE)
+        os.chmod(temp_path, 0o644)  # mkstemp makes the file private to the owner
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+def reflink_file(source_path, dest_path):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported')
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+
+def copy_file(source_path, dest_path):
+    # copyfile uses sendfile on Linux and a chunked copy elsewhere, never reads the whole file
+    shutil.copyfile(source_path, dest_path)
+    with open(dest_path, 'rb') as dest:
+        os.fsync(dest.fileno())
+
+INGEST_METHODS = {'reflink': reflink_file, 'link': os.link, 'copy': copy_file}
+
+def ingest_book_file(book_id, source_path, supported_extensions, keep_original=True):
+    """
+    Put a file from the import directory into the library without reading it through Python where possible.
+    The file is cloned, hard linked or, across devices, copied to a temporary name next to its destination
+    and then renamed into place with os.replace, so the library never has a partial book file.
+    The original is never touched: an import that moves files removes them after its commit,
+    a crash before that leaves the originals in place.
+
+    :param keep_original: the original stays, a reflink is preferred so the two files are independent
+    :return: (path of the book file, ingest method used)
+    """
+    path = book_file_path(book_id, source_path, supported_extensions)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.ingest'
+    methods = ('reflink', 'link', 'copy') if keep_original else ('link', 'copy')
+    for method in methods:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            INGEST_METHODS[method](source_path, temp_path)
+            break
+        except OSError:
+            if method == 'copy':
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                raise
+    os.replace(temp_path, path)
+    # renaming a hardlink over another link of the same file does nothing, e.g. importing a kept file again
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    return path, method
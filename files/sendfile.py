@@ -0,0 +1,91 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from flask import current_app, request
+from werkzeug.utils import send_file
+from config import SENDFILE_HEADER, SENDFILE_PREFIX
+from files.files import BOOKS_DIR
+
+# Sending files of the library directory.
+# ETags are content hashes, remembered per path together with the mtime and size they were computed for,
+# so a file is only read again after it changed. With SENDFILE_HEADER the front proxy sends the file.
+
+CONTENT_HASH_CACHE_SIZE = 10000
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_content_hashes = OrderedDict()
+_lock = threading.Lock()
+
+
+def stat_fingerprint(stat):
+    """
+    Short fingerprint of a file version for URLs, changes whenever the file is replaced or written.
+    """
+    return hashlib.sha1(f'{stat.st_mtime_ns}:{stat.st_size}'.encode('ascii')).hexdigest()[:10]
+
+
+def content_hash(path, stat=None):
+    """
+    SHA-1 of a file's content, cached until its mtime or size changes.
+    """
+    stat = stat or os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _content_hashes.get(path)
+        if cached is not None and cached[0] == version:
+            _content_hashes.move_to_end(path)
+            return cached[1]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    with _lock:
+        _content_hashes[path] = (version, digest)
+        _content_hashes.move_to_end(path)
+        while len(_content_hashes) > CONTENT_HASH_CACHE_SIZE:
+            _content_hashes.popitem(last=False)
+    return digest
+
+
+def send_library_file(path, etag=None, max_age=None, immutable=False, as_attachment=False, download_name=None):
+    """
+    Send a file of BOOKS_DIR, conditional on the ETag. X-Accel-Redirect responses leave the body to nginx.
+
+    :param etag: ETag of the file, e.g. its content hash
+    :param immutable: the URL changes with the content, let clients cache it for a year
+    """
+    if SENDFILE_HEADER.lower() == 'x-accel-redirect':
+        response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{SENDFILE_PREFIX}/{os.path.relpath(path, BOOKS_DIR).replace(os.sep, '/')}"
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name or os.path.basename(path))
+        if etag:
+            response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response = response.make_conditional(request)
+    else:
+        response = send_file(
+            path,
+            request.environ,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=etag or True,
+            max_age=max_age,
+            use_x_sendfile=SENDFILE_HEADER.lower() == 'x-sendfile',
+            response_class=current_app.response_class,
+            _root_path=current_app.root_path,
+        )
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    elif max_age is None:
+        # always revalidate, a matching ETag answers with an empty 304
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import secrets
+import threading
+from datetime import datetime, timedelta
+from files.files import BOOKS_DIR, COPY_BUFFER_SIZE, book_file_path, get_supported_extensions
+from models import FileUpload, db
+
+# Resumable chunked uploads of book files.
+# An upload is created with the file name and size, the client PUTs the file in chunks at the offset
+# the server has received so far and finalizes it when all bytes are there.
+# Chunks are streamed from the request to a .part file in UPLOADS_DIR (on the same file system as the books,
+# so the finished file is moved into place with os.replace) with COPY_BUFFER_SIZE of memory per upload.
+# The SHA-256 is computed while streaming, after a restart it is computed again from the .part file.
+
+UPLOADS_DIR = os.path.join(BOOKS_DIR, '.uploads')
+UPLOAD_MAX_AGE = timedelta(days=7)
+
+_hashes = {}  # upload id -> (bytes hashed, hash object)
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(upload):
+    return os.path.join(UPLOADS_DIR, f'{upload.id}.part')
+
+
+def upload_lock(upload_id):
+    # one request at a time writes to an upload
+    with _locks_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def discard_upload(upload):
+    if os.path.exists(part_path(upload)):
+        os.remove(part_path(upload))
+    _hashes.pop(upload.id, None)
+    with _locks_lock:
+        _locks.pop(upload.id, None)
+    db.session.delete(upload)
+
+
+def discard_book_uploads(book_ids):
+    """
+    Discard the uploads of books that are deleted, before the books (the uploads reference them).
+    """
+    uploads = FileUpload.query.filter(FileUpload.book_id.in_(book_ids)).all()
+    for upload in uploads:
+        discard_upload(upload)
+    db.session.flush()
+    return len(uploads)
+
+
+def purge_uploads():
+    """
+    Delete the uploads that were not continued for UPLOAD_MAX_AGE.
+    """
+    for upload in FileUpload.query.filter(FileUpload.updated_at < datetime.now() - UPLOAD_MAX_AGE):
+        discard_upload(upload)
+
+
+def create_upload(book_id, filename, size):
+    """
+    :raises UploadError: for unsupported file types or invalid sizes
+    """
+    try:
+        book_file_path(book_id, filename, get_supported_extensions())
+    except ValueError as e:
+        raise UploadError(str(e))
+    if not isinstance(size, int) or size < 0:
+        raise UploadError('Invalid file size')
+    purge_uploads()
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    upload = FileUpload(id=secrets.token_hex(16), book_id=book_id, filename=filename, size=size, received=0)
+    open(part_path(upload), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def _get_hash(upload):
+    # the hash of the bytes received so far, computed again from the .part file after a restart
+    hashed, digest = _hashes.get(upload.id, (None, None))
+    if hashed == upload.received:
+        # a copy, a failed chunk must not change the remembered hash
+        return digest.copy()
+    digest = hashlib.sha256()
+    with open(part_path(upload), 'rb') as f:
+        remaining = upload.received
+        while remaining:
+            chunk = f.read(min(COPY_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Append the request body to the upload. The offset has to be the number of bytes received so far.
+
+    :param stream: the request body, read in COPY_BUFFER_SIZE pieces
+    :return: the new number of received bytes
+    :raises UploadError: 409 for another offset, 413 for more bytes than announced
+    """
+    with upload_lock(upload.id):
+        db.session.refresh(upload)
+        if offset != upload.received:
+            raise UploadError(f'Expected offset {upload.received}', 409)
+        digest = _get_hash(upload)
+        written = 0
+        with open(part_path(upload), 'r+b') as f:
+            # bytes after the offset are left from an interrupted chunk
+            f.seek(offset)
+            f.truncate()
+            while True:
+                chunk = stream.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > upload.size:
+                    raise UploadError('More data than the announced file size', 413)
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+        upload.received = offset + written
+        _hashes[upload.id] = (upload.received, digest)
+        db.session.commit()
+        return upload.received
+
+
+def finalize_upload(upload, expected_sha256=None):
+    """
+    Move a complete upload into place as the book file.
+
+    :param expected_sha256: optional hash computed by the client, checked before the file is moved
+    :return: (path of the book file, SHA-256 of the file)
+    :raises UploadError: if bytes are missing or the hash does not match
+    """
+    with upload_lock(upload.id):
+        db.session.refresh(upload)
+        if upload.received != upload.size:
+            raise UploadError(f'Upload incomplete: {upload.received} of {upload.size} bytes', 409)
+        sha256 = _get_hash(upload).hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise UploadError('SHA-256 mismatch, upload the file again')
+        path = book_file_path(upload.book_id, upload.filename, get_supported_extensions())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(part_path(upload), 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(part_path(upload), path)
+        discard_upload(upload)
+        return path, sha256
+
+
+def upload_dict(upload):
+    return {
+        'upload_id': upload.id,
+        'book_id': upload.book_id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.received,
+        'chunk_size': COPY_BUFFER_SIZE * 8,
+    }
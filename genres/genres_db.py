@@ -1,4 +1,4 @@
-from models import Genre, db
+from models import BOOK_TERM_FIELDS, Book, Genre, db, get_or_create_terms, split_terms
 
 
 def get_genres_ids(genres):
@@ -30,4 +30,34 @@ def get_genres_ids(genres):
             genre_ids.append(new_genre.id)
     genre_ids.sort()
     return genre_ids
-    
\ No newline at end of file
+
+
+def get_term_ids(model, names):
+    """
+    Get a name -> id dictionary for Genre/Tag/Language names, inserting the missing ones.
+    Names are matched ignoring case like everywhere else, see get_or_create_terms.
+    """
+    if not names:
+        return {}
+    terms = get_or_create_terms(db.session, model, names)
+    db.session.flush()
+    return {name: term.id for name, term in terms.items()}
+
+
+def replace_book_terms(book_ids, field, value):
+    """
+    Link many books to the genres/tags/languages in a comma-separated value, with set-based statements.
+    Used by bulk updates that bypass the ORM (and so the before_flush sync).
+
+    :param book_ids: ids of the books
+    :param field: 'genre', 'tags' or 'language'
+    :param value: the new comma-separated value of the field
+    """
+    relationship, model = BOOK_TERM_FIELDS[field]
+    table = Book.__mapper__.relationships[relationship].secondary
+    term_column = table.c[f'{model.__tablename__}_id']
+    term_ids = get_term_ids(model, split_terms(value))
+    db.session.execute(table.delete().where(table.c.book_id.in_(book_ids)))
+    links = [{'book_id': book_id, term_column.key: term_id} for book_id in book_ids for term_id in set(term_ids.values())]
+    if links:
+        db.session.execute(table.insert(), links)
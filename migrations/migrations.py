@@ -0,0 +1,245 @@
+from datetime import datetime
+from sqlalchemy import func, inspect, select, text
+from books.fulltext import create_fulltext_index
+from genres.genres_db import get_term_ids
+from models import (
+    BOOK_TERM_FIELDS, Author, Book, Genre, Language, OtherBook, Tag, book_genre, book_language, book_tag, db,
+    refresh_match_keys, split_terms,
+)
+
+# Schema and data migrations for databases created by an older version.
+# db.create_all() only creates missing tables, so new indexes, columns and backfills go here.
+# Every migration runs once, applied migrations are recorded in the schema_migration table.
+
+schema_migration = db.Table(
+    'schema_migration',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, default=datetime.now)
+)
+
+MIGRATIONS = []
+
+BACKFILL_BATCH_SIZE = 1000
+BOOK_TERM_FIELDS_BY_MODEL = {model: relationship for relationship, model in BOOK_TERM_FIELDS.values()}
+
+
+def migration(func):
+    """Register a migration, migrations run in the order they are defined."""
+    MIGRATIONS.append(func)
+    return func
+
+
+def create_missing_indexes(table):
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def add_missing_column(table, column):
+    """Add a column defined on the model to an existing table."""
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table.name)}
+    if column.name in existing:
+        return False
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    return True
+
+
+def run_migrations():
+    schema_migration.create(db.engine, checkfirst=True)
+    applied = set(db.session.execute(select(schema_migration.c.name)).scalars())
+    for migration in MIGRATIONS:
+        if migration.__name__ in applied:
+            continue
+        print(f"Running migration {migration.__name__}")
+        migration()
+        db.session.execute(schema_migration.insert().values(name=migration.__name__))
+        db.session.commit()
+
+
+@migration
+def backfill_book_terms():
+    """
+    Fill book_genre, book_tag and book_language from the comma-separated Book columns.
+    """
+    for table in (Genre.__table__, Tag.__table__, Language.__table__, book_genre, book_tag, book_language):
+        create_missing_indexes(table)
+
+    association_tables = {'genre': book_genre, 'tags': book_tag, 'language': book_language}
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Book.id, Book.genre, Book.tags, Book.language)
+            .where(Book.id > last_id)
+            .order_by(Book.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for field, (_, model) in BOOK_TERM_FIELDS.items():
+            names_by_book = {row.id: split_terms(getattr(row, field)) for row in rows}
+            all_names = {name for names in names_by_book.values() for name in names}
+            term_ids = get_term_ids(model, all_names)
+            table = association_tables[field]
+            term_column = table.c[f'{model.__tablename__}_id']
+            db.session.execute(table.delete().where(table.c.book_id.in_(names_by_book.keys())))
+            links = [
+                {'book_id': book_id, term_column.key: term_ids[name]}
+                for book_id, names in names_by_book.items()
+                for name in names
+            ]
+            if links:
+                db.session.execute(table.insert(), links)
+        db.session.commit()
+        last_id = rows[-1].id
+
+
+@migration
+def add_fulltext_index():
+    """
+    Create the FTS5 table (SQLite) or the FULLTEXT indexes (MariaDB) for library search.
+    """
+    create_fulltext_index()
+
+
+@migration
+def add_book_updated_at():
+    """
+    Add Book.updated_at, existing books start at their creation date.
+    """
+    add_missing_column(Book.__table__, Book.__table__.c.updated_at)
+    db.session.execute(
+        Book.__table__.update()
+        .where(Book.updated_at.is_(None))
+        .values(updated_at=db.func.coalesce(Book.created_at, db.func.now()))
+    )
+
+
+@migration
+def add_match_keys():
+    """
+    Add and fill Book.match_key and OtherBook.match_key, then create their indexes.
+    OtherBook duplicates (same match key) are removed first, the oldest row is kept.
+    """
+    for model in (Book, OtherBook):
+        add_missing_column(model.__table__, model.__table__.c.match_key)
+        last_id = 0
+        while True:
+            ids = db.session.execute(
+                select(model.id).where(model.id > last_id).order_by(model.id).limit(BACKFILL_BATCH_SIZE)
+            ).scalars().all()
+            if not ids:
+                break
+            refresh_match_keys(db.session.connection(), model, model.id.in_(ids))
+            last_id = ids[-1]
+        db.session.commit()
+
+    # wrapped in a derived table, MariaDB cannot delete from a table it selects from
+    keep = (
+        select(func.min(OtherBook.id).label('id'))
+        .where(OtherBook.match_key.isnot(None))
+        .group_by(OtherBook.match_key)
+        .subquery()
+    )
+    duplicates = db.session.execute(
+        OtherBook.__table__.delete()
+        .where(OtherBook.match_key.isnot(None))
+        .where(OtherBook.id.not_in(select(keep.c.id)))
+    ).rowcount
+    if duplicates:
+        print(f"Removed {duplicates} duplicate other books")
+    db.session.commit()
+    for model in (Book, OtherBook):
+        create_missing_indexes(model.__table__)
+
+
+@migration
+def unique_author_names():
+    """
+    Create the unique index of Author.name. Duplicate authors are merged first,
+    their books and other books are moved to the oldest author with the name.
+    """
+    duplicates = db.session.execute(
+        select(func.min(Author.id), Author.name).group_by(Author.name).having(func.count(Author.id) > 1)
+    ).all()
+    for keep_id, name in duplicates:
+        merged = db.session.execute(
+            select(Author.id).where(Author.name == name, Author.id != keep_id)
+        ).scalars().all()
+        for model in (Book, OtherBook):
+            db.session.execute(model.__table__.update().where(model.author_id.in_(merged)).values(author_id=keep_id))
+        db.session.execute(Author.__table__.delete().where(Author.id.in_(merged)))
+    if duplicates:
+        print(f"Merged the duplicates of {len(duplicates)} authors")
+    db.session.commit()
+    create_missing_indexes(Author.__table__)
+
+
+def merge_terms(model, keep_id, merged_ids):
+    # move the books of the merged terms to the kept one, a book linked to both keeps one link
+    table = Book.__mapper__.relationships[BOOK_TERM_FIELDS_BY_MODEL[model]].secondary
+    term_column = table.c[f'{model.__tablename__}_id']
+    linked = db.session.execute(select(table.c.book_id).where(term_column == keep_id)).scalars().all()
+    for i in range(0, len(linked), BACKFILL_BATCH_SIZE):
+        db.session.execute(
+            table.delete()
+            .where(term_column.in_(merged_ids))
+            .where(table.c.book_id.in_(linked[i:i + BACKFILL_BATCH_SIZE]))
+        )
+    db.session.execute(table.update().where(term_column.in_(merged_ids)).values({term_column: keep_id}))
+    db.session.execute(model.__table__.delete().where(model.id.in_(merged_ids)))
+
+
+def replace_other_book_genre_ids(replaced):
+    # OtherBook.genre_ids is a comma-separated list of genre ids
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(OtherBook.id, OtherBook.genre_ids)
+            .where(OtherBook.id > last_id, OtherBook.genre_ids.isnot(None))
+            .order_by(OtherBook.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            ids = [int(genre_id) for genre_id in row.genre_ids.split(',') if genre_id.strip()]
+            if any(genre_id in replaced for genre_id in ids):
+                genre_ids = ','.join(map(str, sorted({replaced.get(genre_id, genre_id) for genre_id in ids})))
+                db.session.execute(
+                    OtherBook.__table__.update().where(OtherBook.id == row.id).values(genre_ids=genre_ids)
+                )
+        db.session.commit()
+        last_id = rows[-1].id
+
+
+@migration
+def unique_term_names():
+    """
+    Make the names of Genre, Tag and Language unique, ignoring case.
+    Terms differing only in case are merged into the oldest one first,
+    then the name indexes are created again as unique indexes.
+    """
+    for model in (Genre, Tag, Language):
+        duplicates = db.session.execute(
+            select(func.min(model.id), func.lower(model.name))
+            .group_by(func.lower(model.name))
+            .having(func.count(model.id) > 1)
+        ).all()
+        replaced = {}
+        for keep_id, name in duplicates:
+            merged = db.session.execute(
+                select(model.id).where(func.lower(model.name) == name, model.id != keep_id)
+            ).scalars().all()
+            merge_terms(model, keep_id, merged)
+            replaced.update({merged_id: keep_id for merged_id in merged})
+        if duplicates:
+            print(f"Merged the duplicates of {len(duplicates)} {model.__tablename__} names")
+        db.session.commit()
+        if model is Genre and replaced:
+            replace_other_book_genre_ids(replaced)
+
+        existing = {index['name']: index for index in inspect(db.engine).get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name in existing and not existing[index.name]['unique']:
+                index.drop(db.engine)
+        create_missing_indexes(model.__table__)
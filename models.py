@@ -1,8 +1,11 @@
 from datetime import datetime
+import unicodedata
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import inspect
+from sqlalchemy import bindparam, func, inspect, select
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import event
+from sqlalchemy.orm import Session
+from serializers import get_serializer
 db = SQLAlchemy()
 
 def compute_sortable_title(title):
@@ -16,9 +19,23 @@ def compute_sortable_title(title):
         return t[2:].strip().lower()
     return t.lower()
 
+MATCH_KEY_LENGTH = 401
+
+def normalize_match_text(value):
+    return ' '.join(unicodedata.normalize('NFKC', value).casefold().split())
+
+def compute_match_key(title, author_name):
+    """
+    Normalized author and title, used to find the same book on import.
+    Case, unicode form and whitespace differences do not matter.
+    """
+    if not title or not author_name:
+        return None
+    return f"{normalize_match_text(author_name)}\t{normalize_match_text(title)}"[:MATCH_KEY_LENGTH]
+
 class Author(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200), nullable=False, index=True, unique=True)  # Unique, imports running at the same time cannot add an author twice
     surname = db.Column(db.String(200), nullable=False)
     surname_first = db.Column(db.String(200), nullable=False)  # Surname first, used for sorting
     cover_image = db.Column(db.String(200))  # URL or path to the cover image
@@ -29,13 +46,7 @@ class Author(db.Model):
         return f'<Author {self.title}>'
 
     def as_dict(self):
-        dict = {c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs}
-
-        # Handle date serialization (if necessary)
-        for key, value in dict.items():
-            if isinstance(value, datetime):
-                dict[key] = value.isoformat()  # Convert datetime to ISO string
-        return dict
+        return get_serializer(type(self)).serialize_object(self)
 
 # Association table for many-to-many relationship
 book_collection = db.Table(
@@ -44,6 +55,27 @@ book_collection = db.Table(
     db.Column('collection_id', db.Integer, db.ForeignKey('collection.id'), primary_key=True)
 )
 
+# Association tables for the genres, tags and languages of a book.
+# The comma-separated Book.genre, Book.tags and Book.language strings stay the source of truth,
+# these tables are kept in sync with them (see sync_book_terms) and used for filtering and facets
+book_genre = db.Table(
+    'book_genre',
+    db.Column('book_id', db.Integer, db.ForeignKey('book.id'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True, index=True)
+)
+
+book_tag = db.Table(
+    'book_tag',
+    db.Column('book_id', db.Integer, db.ForeignKey('book.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True, index=True)
+)
+
+book_language = db.Table(
+    'book_language',
+    db.Column('book_id', db.Integer, db.ForeignKey('book.id'), primary_key=True),
+    db.Column('language_id', db.Integer, db.ForeignKey('language.id'), primary_key=True, index=True)
+)
+
 class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -67,15 +99,20 @@ class Book(db.Model):
     cover_thumbnail = db.Column(db.Text)  # URL or path to the thumbnail image
     publisher = db.Column(db.String(200))  # Publisher name
     created_at = db.Column(db.DateTime, default=datetime.now)  # Date when the book was added
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # Date of the last change, used for ETags
     remote_image_url = db.Column(db.String(400))  # URL of the remote image
     notes = db.Column(db.Text)  # Additional notes about the book
     file_path = db.Column(db.String(300))  # Path to the book file (e.g., PDF, EPUB)
+    match_key = db.Column(db.String(MATCH_KEY_LENGTH), index=True)  # Normalized author and title, see compute_match_key
     # Add collections relationship
     collections = db.relationship(
         'Collection',
         secondary=book_collection,
         back_populates='books'
     )
+    genre_items = db.relationship('Genre', secondary=book_genre)
+    tag_items = db.relationship('Tag', secondary=book_tag)
+    language_items = db.relationship('Language', secondary=book_language)
 
     @hybrid_property
     def computed_sortable_title(self):
@@ -89,15 +126,7 @@ class Book(db.Model):
         return f'<Book {self.title}>'
     
     def as_dict(self):
-        book_dict = {c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs}
-        # include author data
-        book_dict['author_name'] = self.author.name if self.author else None
-
-        # Handle date serialization (if necessary)
-        for key, value in book_dict.items():
-            if isinstance(value, datetime):
-                book_dict[key] = value.isoformat()  # Convert datetime to ISO string
-        return book_dict
+        return get_serializer(type(self)).serialize_object(self)
 
 @event.listens_for(Book, 'before_insert')
 @event.listens_for(Book, 'before_update')
@@ -120,35 +149,125 @@ class OtherBook(db.Model):
     synopsis = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)  # Date when the book was added
     modified_at = db.Column(db.DateTime, onupdate=datetime.now)
+    match_key = db.Column(db.String(MATCH_KEY_LENGTH), index=True, unique=True)  # Normalized author and title, see compute_match_key
 
     def __repr__(self):
         return f'<OtherBook {self.title}>'
     
     def as_dict(self):
-        book_dict = {c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs}
-        # include author data
-        book_dict['author_name'] = self.author.name if self.author else None
-
-        # Handle date serialization (if necessary)
-        for key, value in book_dict.items():
-            if isinstance(value, datetime):
-                book_dict[key] = value.isoformat()  # Convert datetime to ISO string
-        return book_dict
+        return get_serializer(type(self)).serialize_object(self)
     
+class ImportCheckpoint(db.Model):
+    # progress of a bulk catalog load, so an interrupted load can resume
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(64), nullable=False, unique=True)  # fingerprint of the imported file
+    filename = db.Column(db.String(300))
+    rows_done = db.Column(db.Integer, nullable=False, default=0)  # rows read and written, in file order
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ImportCheckpoint {self.filename} {self.rows_done}>'
+
+class ImportJob(db.Model):
+    # an import running in the background, see tools/import_jobs.py
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # csv, catalog, directory, watch
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+    params = db.Column(db.JSON)  # kind-specific parameters, e.g. the directory to import
+    file_path = db.Column(db.String(300))  # uploaded file, kept until the job ends
+    filename = db.Column(db.String(300))
+    rows_done = db.Column(db.Integer, nullable=False, default=0)  # rows of committed chunks, where a resumed job continues
+    rows_parsed = db.Column(db.Integer, nullable=False, default=0)
+    matched = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    rate = db.Column(db.Float)  # rows per second of the current run
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.Text)
+    result = db.Column(db.JSON)  # response of the finished import
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    heartbeat_at = db.Column(db.DateTime)  # last progress of a running job, stale jobs are resumed
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.kind} {self.status}>'
+
+class StagedImport(db.Model):
+    # an import waiting for confirmation, its parsed rows are in StagedImportRow
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)  # csv, notes
+    filename = db.Column(db.String(300))
+    status = db.Column(db.String(20), nullable=False, default='staging')  # staging, staged, confirmed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    existing = db.Column(db.Integer, nullable=False, default=0)  # rows matching a book in the library
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    confirmed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<StagedImport {self.id} {self.status}>'
+
+class StagedImportRow(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    import_id = db.Column(db.Integer, db.ForeignKey('staged_import.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # row order in the import, used for paging
+    data = db.Column(db.JSON, nullable=False)  # the parsed BookImport
+    existing_book_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)  # add, merge, skip
+
+    __table_args__ = (db.Index('ix_staged_import_row_position', 'import_id', 'position'),)
+
+class FileUpload(db.Model):
+    # a chunked book file upload, the received bytes are in UPLOADS_DIR/<id>.part until it is finalized
+    id = db.Column(db.String(32), primary_key=True)  # random token, also used in the URLs
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id'), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)  # announced size of the file
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<FileUpload {self.id} {self.received}/{self.size}>'
+
+class WatchedFile(db.Model):
+    # manifest of the watch folder, a file is imported again only when its mtime or size changes
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), nullable=False, unique=True)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    book_id = db.Column(db.Integer)  # book the file was imported into
+    imported_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<WatchedFile {self.path}>'
+
 class Genre(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200), nullable=False, index=True, unique=True)  # Also unique ignoring case, see get_or_create_terms
 
     def __repr__(self):
         return f'<Genre {self.name}>'
     
     def as_dict(self):
-        genre_dict = {c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs}
-        # Handle date serialization (if necessary)
-        for key, value in genre_dict.items():
-            if isinstance(value, datetime):
-                genre_dict[key] = value.isoformat()  # Convert datetime to ISO string
-        return genre_dict
+        return get_serializer(type(self)).serialize_object(self)
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False, index=True, unique=True)  # Also unique ignoring case, see get_or_create_terms
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+class Language(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), nullable=False, index=True, unique=True)  # Also unique ignoring case, see get_or_create_terms
+
+    def __repr__(self):
+        return f'<Language {self.name}>'
 
 class Collection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -158,4 +277,160 @@ class Collection(db.Model):
         'Book',
         secondary=book_collection,
         back_populates='collections'
-    )
\ No newline at end of file
+    )
+
+def split_terms(value):
+    """
+    Split a comma-separated genre, tag or language string into a list of unique names.
+    Names differing only in case are the same term, the first spelling is kept.
+    """
+    if not value:
+        return []
+    names = {}
+    for name in value.split(','):
+        name = name.strip()
+        if name:
+            names.setdefault(name.casefold(), name)
+    return list(names.values())
+
+def match_names(rows, names):
+    """
+    Match names to the (name, value) rows found for them, ignoring case.
+    An exact match wins, otherwise a row spelled differently, e.g. "Fiction" for "fiction".
+
+    :return: name -> value dictionary of the names that were found
+    """
+    found = dict(rows)
+    folded = {}
+    for row_name, value in rows:
+        folded.setdefault(row_name.casefold(), value)
+    matched = {}
+    for name in names:
+        value = found[name] if name in found else folded.get(name.casefold())
+        if value is not None:
+            matched[name] = value
+    return matched
+
+# Book string column -> (relationship, term model)
+BOOK_TERM_FIELDS = {
+    'genre': ('genre_items', Genre),
+    'tags': ('tag_items', Tag),
+    'language': ('language_items', Language),
+}
+
+def get_or_create_terms(session, model, names):
+    """
+    Get a name -> Genre/Tag/Language dictionary for the names, creating the missing ones (without committing).
+    Names are matched ignoring case, "fiction" and "Fiction" are the same genre whatever the collation.
+    """
+    if not names:
+        return {}
+    names = list(names)
+    with session.no_autoflush:
+        query = session.query(model).filter(func.lower(model.name).in_({name.lower() for name in names}))
+        rows = [(t.name, t) for t in query]
+    # terms created earlier in the same flush are not in the database yet
+    rows += [(obj.name, obj) for obj in session.new if isinstance(obj, model)]
+    terms = match_names(rows, names)
+    created = {}
+    for name in names:
+        if name not in terms:
+            if name.casefold() not in created:
+                created[name.casefold()] = model(name=name)
+                session.add(created[name.casefold()])
+            terms[name] = created[name.casefold()]
+    return terms
+
+def sync_books_terms(session, books):
+    """
+    Update the genre, tag and language associations of books from their comma-separated columns.
+    The terms of all books are looked up with one query per term type.
+    """
+    for field, (relationship, model) in BOOK_TERM_FIELDS.items():
+        names_by_book = {}
+        for book in books:
+            names = split_terms(getattr(book, field))
+            current = [t.name for t in getattr(book, relationship)]
+            if {name.casefold() for name in names} != {name.casefold() for name in current}:
+                names_by_book[book] = names
+        if not names_by_book:
+            continue
+        all_names = {name for names in names_by_book.values() for name in names}
+        terms = get_or_create_terms(session, model, all_names)
+        for book, names in names_by_book.items():
+            setattr(book, relationship, [terms[name] for name in names])
+    return books
+
+def sync_book_terms(session, book):
+    """
+    Update the genre, tag and language associations of a book from its comma-separated columns.
+    """
+    sync_books_terms(session, [book])
+    return book
+
+@event.listens_for(Session, 'before_flush')
+def sync_changed_book_terms(session, flush_context, instances):
+    # keep the association tables in sync for books changed outside update_book_fields/fill_book_data
+    changed_books = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Book):
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(state.attrs[field].history.has_changes() for field in BOOK_TERM_FIELDS):
+            changed_books.append(obj)
+    if changed_books:
+        sync_books_terms(session, changed_books)
+
+MATCH_KEY_MODELS = (Book, OtherBook)
+
+@event.listens_for(Session, 'before_flush')
+def set_changed_match_keys(session, flush_context, instances):
+    # keep match_key in sync with the title and the author name
+    changed = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, MATCH_KEY_MODELS):
+            continue
+        attrs = inspect(obj).attrs
+        if obj in session.new or any(attrs[key].history.has_changes() for key in ('title', 'author_id', 'author')):
+            changed.append(obj)
+    if not changed:
+        return
+    # the author relationship is used if it was set, otherwise the name is looked up by author_id
+    author_set = {obj for obj in changed if inspect(obj).attrs.author.history.has_changes()}
+    author_ids = {obj.author_id for obj in changed if obj not in author_set and obj.author_id is not None}
+    names = {}
+    if author_ids:
+        with session.no_autoflush:
+            names = dict(session.execute(select(Author.id, Author.name).where(Author.id.in_(author_ids))).all())
+    for obj in changed:
+        if obj in author_set:
+            name = obj.author.name if obj.author is not None else None
+        else:
+            name = names.get(obj.author_id)
+        obj.match_key = compute_match_key(obj.title, name)
+
+def refresh_match_keys(connection, model, condition):
+    """
+    Recompute match_key of the Book/OtherBook rows matching the condition,
+    for changes that bypass the ORM (bulk updates, author renames).
+    """
+    rows = connection.execute(
+        select(model.id, model.title, Author.name)
+        .join(Author, model.author_id == Author.id)
+        .where(condition)
+    ).all()
+    if not rows:
+        return 0
+    table = model.__table__
+    connection.execute(
+        table.update().where(table.c.id == bindparam('row_id')).values(match_key=bindparam('key')),
+        [{'row_id': row.id, 'key': compute_match_key(row.title, row.name)} for row in rows],
+    )
+    return len(rows)
+
+@event.listens_for(Author, 'after_update')
+def refresh_author_match_keys(mapper, connection, target):
+    if not inspect(target).attrs.name.history.has_changes():
+        return
+    for model in MATCH_KEY_MODELS:
+        refresh_match_keys(connection, model, model.author_id == target.id)
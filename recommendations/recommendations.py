@@ -1,4 +1,3 @@
-from genres.genres_db import get_genres_ids
 from models import Book, OtherBook, db
 
 
@@ -8,7 +7,7 @@ def genres_to_ids(genre_str):
 # Compute recommendations for a given book
 def recommend_books(target_book, session, top_n=10):
     # collect book genre ids
-    target_genres = set(get_genres_ids(target_book.genre))
+    target_genres = set(genre.id for genre in target_book.genre_items)
     # grab all other books from the database, with id and genres
     other_books = session.query(OtherBook.id, OtherBook.genre_ids).filter(OtherBook.genre_ids != None).filter(OtherBook.genre_ids != '')
     # skip this author as we'd like to recommend books from other authors
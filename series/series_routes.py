@@ -1,4 +1,6 @@
 from flask import Blueprint, jsonify
+from cache.etag import conditional_get, library_etag
+from cache.response_cache import cached_response
 from models import Book
 
 series_bp = Blueprint('series', __name__, url_prefix='/series')
@@ -6,6 +8,8 @@ series_bp = Blueprint('series', __name__, url_prefix='/series')
 SIZE_THUMBNAIL = (128, 200)
 
 @series_bp.route('/api')
+@conditional_get(library_etag)
+@cached_response
 def list_series_api():
     query = Book.query.with_entities(Book.series).order_by(Book.series).distinct().all()
     # TODO handle empty series
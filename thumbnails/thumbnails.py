@@ -1,16 +1,35 @@
 import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 import requests
+from sqlalchemy import event
+from config import COVER_WEBP, IMPORT_WORKERS
 from files.files import BOOKS_DIR
 from models import Book, db
-from PIL import Image
+from PIL import Image, ImageOps
 
 import os
 
 THUMBNAIL_SIZE = (64, 64)  # Set the desired thumbnail size
 THUMBNAIL_SIZE_LARGE = (128, 200)
 
+# Every local cover (data/<book_id>/cover.<ext>) gets resized variants next to it:
+# cover_tiny.jpg for lists, cover_grid.jpg for the book grid and cover_large.jpg for the book page,
+# with COVER_WEBP also a .webp of each. They are made when a cover is stored, in a process pool,
+# and made again on demand when one is missing or older than the cover.
+COVER_NAME = 'cover'
+COVER_VARIANTS = {
+    'tiny': THUMBNAIL_SIZE,
+    'grid': THUMBNAIL_SIZE_LARGE,
+    'large': (600, 900),
+}
+COVER_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP'} if COVER_WEBP else {'jpg': 'JPEG'}
+COVER_QUALITY = 85
+COVER_TINY_FILENAME = f'{COVER_NAME}_tiny.jpg'
+
+_cover_pool = None
+
 
 def download_cover_image(book_id, cover_image_url):
     """
@@ -25,19 +44,141 @@ def download_cover_image(book_id, cover_image_url):
     try:
         response = requests.get(cover_image_url, stream=True)
         response.raise_for_status()  # Raise HTTPError for bad responses
-
-        # Extract filename from URL
-        # we suppose it's jpeg, not png
-        ext = '.jpg'
-        path = f'{book_id}/cover{ext}'
-        path = os.path.join(BOOKS_DIR, path)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        filename = os.path.basename(path)
+        filename = save_cover_image(book_id, response)
+        create_cover_variants(book_id)
         return filename
     except requests.exceptions.RequestException as e:
         print(f"Error downloading cover image: {e}")
         return None
+
+
+def save_cover_image(book_id, response):
+    """
+    Write a streamed cover image response to the book folder, through a temporary file.
+
+    :return: file name of the cover
+    """
+    # we suppose it's jpeg, not png
+    ext = '.jpg'
+    path = f'{book_id}/{COVER_NAME}{ext}'
+    path = os.path.join(BOOKS_DIR, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.download'
+    with open(temp_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            f.write(chunk)
+    os.replace(temp_path, path)
+    return os.path.basename(path)
+
+
+def cover_variant_filename(variant, extension='jpg'):
+    return f'{COVER_NAME}_{variant}.{extension}'
+
+
+COVER_VARIANT_FILES = {
+    cover_variant_filename(variant, extension): variant
+    for variant in COVER_VARIANTS for extension in COVER_FORMATS
+}
+
+
+def find_cover_source(book_id):
+    """
+    Path of the original cover of a book, the newest cover.<ext> in its folder, None if it has none.
+    """
+    folder = os.path.join(BOOKS_DIR, str(book_id))
+    try:
+        names = [name for name in os.listdir(folder) if os.path.splitext(name)[0] == COVER_NAME]
+    except FileNotFoundError:
+        return None
+    paths = [os.path.join(folder, name) for name in names]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def make_cover_variants(book_id):
+    """
+    Resize the cover of a book into all variants. Runs in a worker process, without the database.
+
+    :return: list of the written file names, empty if the book has no cover
+    """
+    source = find_cover_source(book_id)
+    if source is None:
+        return []
+    folder = os.path.dirname(source)
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            # transparent covers are put on white, JPEG has no alpha
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            image = image.convert('RGBA')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        written = []
+        for variant, size in COVER_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            for extension, image_format in COVER_FORMATS.items():
+                filename = cover_variant_filename(variant, extension)
+                temp_path = os.path.join(folder, filename + '.tmp')
+                resized.save(temp_path, image_format, quality=COVER_QUALITY, optimize=True)
+                os.replace(temp_path, os.path.join(folder, filename))
+                written.append(filename)
+    return written
+
+
+def get_cover_pool():
+    global _cover_pool
+    if _cover_pool is None:
+        _cover_pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS)
+    return _cover_pool
+
+
+def generate_cover_variants(book_ids):
+    """
+    Make the cover variants of many books in the process pool.
+
+    :return: book_id -> list of written file names, None if the cover could not be read
+    """
+    futures = {book_id: get_cover_pool().submit(make_cover_variants, book_id) for book_id in book_ids}
+    results = {}
+    for book_id, future in futures.items():
+        try:
+            results[book_id] = future.result()
+        except Exception as e:
+            print(f"Error resizing cover of book {book_id}: {e}")
+            results[book_id] = None
+    return results
+
+
+def create_cover_variants(book_id):
+    """
+    Make the cover variants of a book that just got a new cover, True if they were written.
+    """
+    return bool(generate_cover_variants([book_id])[book_id])
+
+
+def ensure_cover_variant(book_id, filename):
+    """
+    Make the variants of a book's cover on demand if the requested one is missing or older than the cover.
+
+    :return: True if the variant file exists now
+    """
+    if filename not in COVER_VARIANT_FILES:
+        return False
+    path = os.path.join(BOOKS_DIR, str(book_id), filename)
+    source = find_cover_source(book_id)
+    if source is None:
+        return os.path.exists(path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        try:
+            make_cover_variants(book_id)
+        except Exception as e:
+            print(f"Error resizing cover of book {book_id}: {e}")
+    return os.path.exists(path)
+
+
+@event.listens_for(Book, 'before_insert')
+@event.listens_for(Book, 'before_update')
+def set_cover_image_tiny(mapper, connection, target):
+    # a cover stored in the book folder has a tiny variant, a missing one is made on its first request
+    if target.cover_image and not target.cover_image.startswith('http'):
+        target.cover_image_tiny = COVER_TINY_FILENAME
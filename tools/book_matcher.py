@@ -0,0 +1,54 @@
+from sqlalchemy import select
+from models import compute_match_key, db
+
+MATCH_BATCH_SIZE = 500
+
+
+class BookMatcher:
+    """
+    Finds the existing Book/OtherBook rows for (title, author name) pairs by their indexed match_key.
+    Lookups are batched into IN queries. With preload=True all keys of the table are read once
+    into a dictionary, which suits imports that check most of a (small) table.
+    For keys shared by several books (Book allows duplicates) the lowest id is returned.
+    """
+
+    def __init__(self, model, preload=False):
+        self.model = model
+        self._ids = {}
+        self._preloaded = False
+        if preload:
+            self.preload()
+
+    def _lookup(self, condition):
+        rows = db.session.execute(
+            select(self.model.match_key, self.model.id)
+            .where(condition)
+            .order_by(self.model.id.desc())
+        )
+        # descending order, so the lowest id is assigned last
+        self._ids.update(rows.all())
+
+    def preload(self):
+        self._lookup(self.model.match_key.isnot(None))
+        self._preloaded = True
+
+    def match(self, pairs):
+        """
+        :param pairs: iterable of (title, author name)
+        :return: match key -> id of the existing row
+        """
+        keys = {compute_match_key(title, author_name) for title, author_name in pairs}
+        keys.discard(None)
+        if not self._preloaded:
+            missing = [key for key in keys if key not in self._ids]
+            for i in range(0, len(missing), MATCH_BATCH_SIZE):
+                self._lookup(self.model.match_key.in_(missing[i:i + MATCH_BATCH_SIZE]))
+        return {key: self._ids[key] for key in keys if key in self._ids}
+
+    def match_one(self, title, author_name):
+        key = compute_match_key(title, author_name)
+        return self.match([(title, author_name)]).get(key)
+
+    def remember(self, key, row_id):
+        """Add a row created during the import."""
+        self._ids[key] = row_id
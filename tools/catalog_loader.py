@@ -0,0 +1,230 @@
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from authors.authors_tools import author_resolver, extract_main_author
+from book_tools import extract_genres, extract_isbn, extract_year
+from config import IMPORT_WORKERS
+from genres.genres_db import get_term_ids
+from models import Genre, ImportCheckpoint, OtherBook, compute_match_key, db, split_terms
+from tools.csv_stream import ImportStats, open_csv_reader, read_chunks
+
+# Bulk loader for the OtherBook catalog (the "all books" dataset used by recommendations).
+# Worker processes parse and normalize the CSV rows, the main process resolves authors and
+# genres chunk by chunk and writes every chunk with one upsert on match_key.
+# Each chunk is committed together with the checkpoint, so an interrupted load resumes after the last chunk.
+
+LOADER_WORKERS = IMPORT_WORKERS
+LOADER_CHUNK_SIZE = 2000
+FINGERPRINT_BYTES = 1024 * 1024
+
+# columns replaced when a book with the same match key already exists
+UPSERT_COLUMNS = ['title', 'author_id', 'year_published', 'isbn', 'rating', 'genre', 'genre_ids', 'language',
+                  'synopsis', 'modified_at']
+
+
+def parse_other_csv_row(row):
+    """
+    Convert a CSV row of the other (all) books import to OtherBook values, None if the row is invalid.
+    Runs in the worker processes.
+    """
+    title = row.get('title')
+    if title and len(title) > 190:
+        # truncate title to 190 characters
+        title = title[:190] + "..."
+    author_name = row.get('author')
+    # Check for required fields
+    if not all([title, author_name]):
+        return None
+    author_name = extract_main_author(author_name)
+    isbn = row.get('isbn')
+    isbn13 = row.get('isbn13')
+    isbn = extract_isbn(isbn, isbn13)
+
+    average_rating = row.get('average rating')
+    if not average_rating:
+        average_rating = row.get('rating')
+    year_published = extract_year(row)
+
+    description = row.get('description')
+    # shorten to 300 characters
+    if description and len(description) > 300:
+        description = description[:300] + '...'
+    genres = row.get('genres')
+    genres = extract_genres(genres)
+    language = row.get('language')
+    # if language has commas, split it and take the first one
+    if language and ',' in language:
+        language = language.split(',')[0].strip()
+    if language and ';' in language:
+        language = language.split(';')[0].strip()
+    # strip to 20 characters
+    if language and len(language) > 20:
+        language = language[:20]
+
+    match_key = compute_match_key(title, author_name)
+    if match_key is None:
+        return None
+
+    # Convert data types
+    average_rating = float(average_rating) if average_rating else None
+    year_published = int(year_published) if year_published else None
+
+    return {
+        'title': title,
+        'author_name': author_name,
+        'match_key': match_key,
+        'year_published': year_published,
+        'isbn': isbn,
+        'rating': average_rating,
+        'synopsis': description,
+        'language': language,
+        'genre': genres,
+    }
+
+
+def parse_catalog_chunk(rows):
+    """
+    Parse a chunk of CSV rows in a worker process.
+
+    :return: (number of rows, list of OtherBook values)
+    """
+    books = []
+    for row in rows:
+        try:
+            book = parse_other_csv_row(row)
+        except (ValueError, TypeError) as e:
+            print(f"Skipping row due to invalid data: {row} - {e}")
+            continue
+        if book is not None:
+            books.append(book)
+    return len(rows), books
+
+
+def file_fingerprint(stream, filename):
+    """
+    Identify an uploaded file by its name, size and first megabyte, without reading all of it.
+    """
+    digest = hashlib.sha256(filename.encode('utf-8'))
+    digest.update(stream.read(FINGERPRINT_BYTES))
+    stream.seek(0, os.SEEK_END)
+    digest.update(str(stream.tell()).encode('ascii'))
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def upsert_statement():
+    table = OtherBook.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.match_key],
+            set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS},
+        )
+    elif dialect in ('mysql', 'mariadb'):
+        stmt = mysql_insert(table)
+        return stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in UPSERT_COLUMNS})
+    raise ValueError(f"Bulk catalog load is not supported for {dialect}")
+
+
+class CatalogWriter:
+    """
+    Writes parsed chunks: authors and genres are resolved with one lookup per chunk,
+    the genre ids are remembered for the whole load.
+    """
+
+    def __init__(self):
+        self.statement = upsert_statement()
+        self.genre_ids = {}
+
+    def resolve_genres(self, names):
+        missing = [name for name in names if name not in self.genre_ids]
+        if missing:
+            self.genre_ids.update(get_term_ids(Genre, missing))
+
+    def write(self, books):
+        # the same book can be in a chunk twice, the last row wins
+        books = list({book['match_key']: book for book in books}.values())
+        if not books:
+            return 0
+        author_ids = author_resolver.resolve_ids(book['author_name'].strip() for book in books)
+        genres = {book['match_key']: split_terms(book['genre']) for book in books}
+        self.resolve_genres({name for names in genres.values() for name in names})
+        now = datetime.now()
+        rows = []
+        for book in books:
+            values = dict(book)
+            values['author_id'] = author_ids[values.pop('author_name').strip()]
+            values['genre_ids'] = ','.join(map(str, sorted({self.genre_ids[name] for name in genres[book['match_key']]})))
+            values['created_at'] = now
+            values['modified_at'] = now
+            rows.append(values)
+        db.session.execute(self.statement, rows)
+        return len(rows)
+
+
+def get_checkpoint(source, filename):
+    checkpoint = ImportCheckpoint.query.filter_by(source=source).first()
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=source, filename=filename, rows_done=0, imported=0, skipped=0)
+        db.session.add(checkpoint)
+    elif checkpoint.finished_at is not None:
+        # loading a finished file again starts over, the upsert makes it idempotent
+        checkpoint.rows_done = checkpoint.imported = checkpoint.skipped = 0
+        checkpoint.started_at = datetime.now()
+        checkpoint.finished_at = None
+    db.session.commit()
+    return checkpoint
+
+
+def load_catalog(stream, filename, workers=LOADER_WORKERS, chunk_size=LOADER_CHUNK_SIZE, on_chunk=None):
+    """
+    Load a catalog CSV into OtherBook, resuming an interrupted load of the same file.
+
+    :param stream: binary file object of the CSV
+    :param filename: name of the uploaded file, part of the checkpoint fingerprint
+    :param on_chunk: optional callback on_chunk(parsed=, inserted=, failed=) after each committed chunk
+    :return: (ImportStats of this run, number of rows skipped because a previous run loaded them)
+    """
+    checkpoint = get_checkpoint(file_fingerprint(stream, filename), filename)
+    resumed_from = checkpoint.rows_done
+    if resumed_from:
+        print(f"Resuming {checkpoint.filename} after {resumed_from} rows")
+    reader = open_csv_reader(stream)
+    rows = islice(reader, resumed_from, None)
+    writer = CatalogWriter()
+    stats = ImportStats()
+
+    def write_chunk(result):
+        row_count, books = result
+        imported = writer.write(books)
+        stats.chunks += 1
+        stats.rows += row_count
+        stats.imported += imported
+        stats.skipped += row_count - len(books)
+        checkpoint.rows_done += row_count
+        checkpoint.imported += imported
+        checkpoint.skipped += row_count - len(books)
+        db.session.commit()
+        if on_chunk:
+            on_chunk(parsed=row_count, inserted=imported, failed=row_count - len(books))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # results are written in file order, so rows_done is always a prefix of the file
+        pending = deque()
+        for chunk in read_chunks(rows, chunk_size):
+            pending.append(pool.submit(parse_catalog_chunk, chunk))
+            if len(pending) >= workers * 2:
+                write_chunk(pending.popleft().result())
+        while pending:
+            write_chunk(pending.popleft().result())
+
+    checkpoint.finished_at = datetime.now()
+    db.session.commit()
+    stats.finish().report(f'load_catalog {checkpoint.filename}')
+    return stats, resumed_from
@@ -0,0 +1,70 @@
+import csv
+import io
+import time
+from dataclasses import dataclass, field
+
+# Incremental CSV reading for the imports.
+# The upload is decoded while it is read and the rows are handed out in fixed-size chunks,
+# so the memory used depends on the chunk size and not on the size of the file.
+
+CSV_CHUNK_SIZE = 1000
+
+
+def open_csv_reader(file, encoding='utf-8-sig'):
+    """
+    DictReader over an uploaded file that decodes the stream as it is read.
+    The header names are lower-cased, utf-8-sig also drops the BOM of Excel exports.
+
+    :param file: werkzeug FileStorage from request.files or a binary file object
+    """
+    stream = getattr(file, 'stream', file)
+    text = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+    reader = csv.DictReader(text)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    return reader
+
+
+def read_chunks(reader, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Yield lists of at most chunk_size rows.
+    """
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    imported: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.elapsed, 1) if self.elapsed else None
+
+    def report(self, name):
+        print(f"{name}: {self.rows} rows ({self.imported} imported, {self.skipped} skipped) "
+              f"in {self.chunks} chunks, {self.elapsed:.2f}s, {self.rows_per_second} rows/s")
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+        }
@@ -2,6 +2,7 @@
 from flask import Blueprint, jsonify, request
 from models import Author, Book, Genre, OtherBook, db
 from recommendations.recommendations import get_recommendations_for_book
+from thumbnails.thumbnails import COVER_TINY_FILENAME, generate_cover_variants
 
 fix_bp = Blueprint('fix', __name__, url_prefix='/fix')
 
@@ -26,4 +27,22 @@ def fix_genres():
             print(f"Fixed {book.title} with {other_book.genre}")
     db.session.commit()
     return jsonify({'status': 'ok'})
-    
\ No newline at end of file
+    
+
+
+@fix_bp.route('/covers')
+def fix_covers():
+    # make the resized variants of the local covers that have none yet, ?all=1 makes all of them again
+    query = Book.query.filter(Book.cover_image.isnot(None), Book.cover_image.notlike('http%'))
+    if not request.args.get('all'):
+        query = query.filter(Book.cover_image_tiny.is_(None))
+    book_ids = [book_id for (book_id, ) in query.with_entities(Book.id)]
+    resized = 0
+    for i in range(0, len(book_ids), 200):
+        results = generate_cover_variants(book_ids[i:i + 200])
+        done = [book_id for book_id, written in results.items() if written]
+        if done:
+            Book.query.filter(Book.id.in_(done)).update({Book.cover_image_tiny: COVER_TINY_FILENAME}, synchronize_session=False)
+            db.session.commit()
+        resized += len(done)
+    return jsonify({'status': 'ok', 'books': len(book_ids), 'resized': resized})
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import jsonify, request
+from sqlalchemy import or_, select, update
+from models import ImportJob, db
+
+# Background import jobs.
+# An import endpoint creates an ImportJob and the runner executes it in a worker thread.
+# The job handler commits its work chunk by chunk together with the job counters (JobContext.chunk_done),
+# so progress can be polled, a cancel request is seen after the current chunk, and a job
+# interrupted by a restart is resumed from its last committed chunk (rows_done).
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+IMPORT_JOB_WORKERS = 2
+IMPORT_JOBS_DIR = os.path.abspath("import_jobs")
+# a running job without a heartbeat for this long is considered dead and can be resumed
+JOB_STALE_AFTER = timedelta(minutes=2)
+# the heartbeat of a running job is refreshed by a timer, independently of how long its chunks take
+JOB_HEARTBEAT_INTERVAL = 30  # seconds
+RESUME_CHECK_INTERVAL = 30  # seconds
+# how long an import endpoint waits for its job, small imports still answer with the result directly
+JOB_WAIT_SECONDS = 5
+
+JOB_HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def import_job(kind):
+    """Register the handler of a job kind, the handler gets a JobContext and returns the job result."""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    def __init__(self, job):
+        self.job = job
+        self._started = time.perf_counter()
+        self._start_rows = job.rows_parsed
+
+    def chunk_done(self, parsed=0, matched=0, inserted=0, failed=0):
+        """
+        Add the counts of a chunk and commit them with the chunk's data.
+
+        :raises JobCancelled: if the job was cancelled in the meantime
+        """
+        job = self.job
+        job.rows_done += parsed
+        job.rows_parsed += parsed
+        job.matched += matched
+        job.inserted += inserted
+        job.failed += failed
+        elapsed = time.perf_counter() - self._started
+        job.rate = round((job.rows_parsed - self._start_rows) / elapsed, 1) if elapsed else None
+        job.heartbeat_at = datetime.now()
+        db.session.commit()
+        # the commit expired the job, this reads the cancel flag set by another request
+        if job.cancel_requested:
+            raise JobCancelled()
+
+
+def save_job_file(file_storage):
+    """
+    Keep an uploaded file on disk for a job, so the job can be resumed after a restart.
+    """
+    os.makedirs(IMPORT_JOBS_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_JOBS_DIR, f'{time.time_ns()}.upload')
+    file_storage.save(path)
+    return path
+
+
+def job_dict(job, with_result=True):
+    data = {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'filename': job.filename,
+        'rows_parsed': job.rows_parsed,
+        'matched': job.matched,
+        'inserted': job.inserted,
+        'failed': job.failed,
+        'rate': job.rate,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if with_result:
+        data['result'] = job.result
+    return data
+
+
+class ImportJobRunner:
+    def __init__(self, max_workers=IMPORT_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import-job')
+        self._finished = {}
+        self._lock = threading.Lock()
+        self._last_resume_check = 0
+
+    def submit(self, app, job_id):
+        with self._lock:
+            if job_id in self._finished and not self._finished[job_id].is_set():
+                return
+            self._finished[job_id] = threading.Event()
+        self._executor.submit(self._run, app, job_id)
+
+    def wait(self, job_id, timeout):
+        """Wait until the job ends, True if it did."""
+        finished = self._finished.get(job_id)
+        return finished.wait(timeout) if finished is not None else False
+
+    def _claim(self, job_id):
+        # the conditional update makes sure only one worker (or process) runs the job
+        stale = datetime.now() - JOB_STALE_AFTER
+        claimed = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id)
+            .where(or_(
+                ImportJob.status == STATUS_QUEUED,
+                (ImportJob.status == STATUS_RUNNING) & or_(ImportJob.heartbeat_at.is_(None), ImportJob.heartbeat_at < stale),
+            ))
+            .values(status=STATUS_RUNNING, heartbeat_at=datetime.now())
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _heartbeat(self, app, job_id, stopped):
+        # own connection and transaction, the job's session may be in the middle of a chunk
+        with app.app_context():
+            while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            update(ImportJob)
+                            .where(ImportJob.id == job_id, ImportJob.status == STATUS_RUNNING)
+                            .values(heartbeat_at=datetime.now())
+                        )
+                except Exception as e:
+                    print(f"Heartbeat of import job {job_id} failed: {e}")
+
+    def _run(self, app, job_id):
+        heartbeat_stopped = threading.Event()
+        with app.app_context():
+            try:
+                if not self._claim(job_id):
+                    return
+                threading.Thread(target=self._heartbeat, args=(app, job_id, heartbeat_stopped),
+                                 name=f'import-job-{job_id}-heartbeat', daemon=True).start()
+                job = db.session.get(ImportJob, job_id)
+                if job.cancel_requested:
+                    raise JobCancelled()
+                print(f"Running import job {job.id} ({job.kind}), resuming after {job.rows_done} rows")
+                result = JOB_HANDLERS[job.kind](JobContext(job))
+                self._finish(job_id, STATUS_DONE, result=result)
+            except JobCancelled:
+                db.session.rollback()
+                self._finish(job_id, STATUS_CANCELLED)
+            except Exception as e:
+                print(f"Import job {job_id} failed: {e}")
+                db.session.rollback()
+                self._finish(job_id, STATUS_FAILED, error=str(e))
+            finally:
+                heartbeat_stopped.set()
+                db.session.remove()
+                self._finished[job_id].set()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        job = db.session.get(ImportJob, job_id)
+        job.status = status
+        # a cancelled or failed job keeps the partial result of its committed chunks
+        if result is not None:
+            job.result = result
+        job.error = error
+        job.finished_at = datetime.now()
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        db.session.commit()
+        print(f"Import job {job.id} {status}: {job.rows_parsed} rows, {job.inserted} inserted, {job.failed} failed")
+
+    def resume_stale(self, app):
+        """
+        Submit the queued jobs and the running jobs without recent progress, e.g. after a restart.
+        Checked at most every RESUME_CHECK_INTERVAL seconds.
+        """
+        now = time.monotonic()
+        if now - self._last_resume_check < RESUME_CHECK_INTERVAL:
+            return
+        self._last_resume_check = now
+        stale = datetime.now() - JOB_STALE_AFTER
+        job_ids = db.session.execute(
+            select(ImportJob.id)
+            .where(ImportJob.status.in_(ACTIVE_STATUSES))
+            .where(or_(ImportJob.heartbeat_at.is_(None), ImportJob.heartbeat_at < stale))
+        ).scalars().all()
+        for job_id in job_ids:
+            self.submit(app, job_id)
+
+
+import_job_runner = ImportJobRunner()
+
+
+def start_import_job(app, kind, file_storage=None, **params):
+    """
+    Create and submit a job.
+
+    :param file_storage: uploaded file the job reads, saved to IMPORT_JOBS_DIR
+    :param params: kind-specific parameters stored with the job
+    """
+    job = ImportJob(kind=kind, status=STATUS_QUEUED, params=params, rows_done=0, rows_parsed=0,
+                    matched=0, inserted=0, failed=0, cancel_requested=False)
+    if file_storage is not None:
+        job.filename = file_storage.filename
+        job.file_path = save_job_file(file_storage)
+    db.session.add(job)
+    db.session.commit()
+    import_job_runner.submit(app, job.id)
+    return job
+
+
+def cancel_import_job(job):
+    """
+    Request the cancellation of a job, a queued job is cancelled right away.
+    """
+    if job.status not in ACTIVE_STATUSES:
+        return False
+    job.cancel_requested = True
+    db.session.commit()
+    # a job that has not started yet will not check the flag, unless a worker claims it first
+    cancelled = db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job.id, ImportJob.status == STATUS_QUEUED)
+        .values(status=STATUS_CANCELLED, finished_at=datetime.now())
+    ).rowcount
+    db.session.commit()
+    if cancelled and job.file_path and os.path.exists(job.file_path):
+        os.remove(job.file_path)
+    return True
+
+
+def init_import_jobs(app):
+    # resumed from a request, so only the process that serves requests runs jobs (not the reloader)
+    @app.before_request
+    def resume_import_jobs():
+        import_job_runner.resume_stale(app)
+
+
+def job_response(job, error_message='Import failed'):
+    """
+    Wait shortly for a job. A job that finishes in time answers with its result, like a synchronous import,
+    a longer one with 202 and the job, to poll at /import/jobs/<id>. ?wait=<seconds> changes the wait.
+    """
+    wait = min(max(request.args.get('wait', default=JOB_WAIT_SECONDS, type=float), 0), 60)
+    if wait:
+        import_job_runner.wait(job.id, wait)
+    db.session.refresh(job)
+    if job.status == STATUS_DONE:
+        return jsonify(job.result), 200
+    if job.status == STATUS_FAILED:
+        return jsonify({'status': 'error', 'message': error_message, 'job': job_dict(job)}), 500
+    return jsonify({'status': 'accepted', 'job': job_dict(job)}), 202
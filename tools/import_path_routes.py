@@ -1,14 +1,26 @@
 import os
-from flask import Blueprint, request, jsonify, abort
-from authors.authors_tools import get_author_by_name
-from files.files import get_supported_extensions, save_book_file
-from models import Book, db
-from tools.metadata_calibre import get_metadata
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from flask import Blueprint, current_app, request, jsonify, abort
+from authors.authors_tools import author_resolver, get_authors_by_names
+from config import IMPORT_WORKERS
+from files.files import get_supported_extensions, ingest_book_file
+from models import Book, compute_match_key, db
+from tools.book_matcher import BookMatcher
+from tools.import_jobs import import_job, job_response, start_import_job
+from tools.metadata_cache import file_fingerprint, metadata_cache
+from tools.metadata_readers import get_metadata
 
 BASE_IMPORT_DIR = os.getcwd()  # Set the base import directory to the current working directory
 
 import_path_bp = Blueprint('import_path', __name__, url_prefix='/import_path')
 
+JOB_DIRECTORY = 'directory'
+DIRECTORY_CHUNK_SIZE = 50
+
 def safe_join(base, *paths):
     # Prevents directory traversal attacks
     final_path = os.path.abspath(os.path.join(base, *paths))
@@ -58,64 +70,197 @@ def import_dir():
     if not os.path.isdir(abs_path):
         abort(404, "Directory not found")
 
-    supported_extensions = get_supported_extensions()
+    # ?keep=1 leaves the files in the directory, the library links or copies them
+    keep = request.args.get('keep', '').lower() in ('1', 'true', 'yes')
+    # imported in a background job, the files are moved into the library chunk by chunk
+    job = start_import_job(current_app._get_current_object(), JOB_DIRECTORY, path=abs_path, keep=keep)
+    return job_response(job)
 
-    added_books = [] # will store tuple of (book, file_path)
 
+def iter_import_files(abs_path):
+    supported_extensions = get_supported_extensions()
     # List all files in the directory - but recursively
     for root, dirs, files in os.walk(abs_path):
-        for filename in files:
+        dirs.sort()
+        for filename in sorted(files):
             file_path = os.path.join(root, filename)
-            # Process the file
             # if it's not a supported file type, skip it
-            if not any(file_path.lower().endswith(ext) for ext in supported_extensions):
-                continue
-            # Here you can add logic to import the file
-            # For now, we will just print the file path
-            print(f"Found supported file: {file_path}")
-            author, title = get_metadata(file_path)
-
-            # try to get author and title from file name if metadata extraction fails
-            if author is None or title is None:
-                just_filename = os.path.splitext(filename)[0]
-                author, title = just_filename.split(' - ', 1) if ' - ' in just_filename else (None, None)
-            if author is None:
-                # If we still don't have an author, we can set a default value
-                # Fallback to file name
-                author = "Unknown"
-                title = os.path.splitext(filename)[0]
-            # generate a Book object
-            # the same code as in confirm_import_api()
-            author = get_author_by_name(author.strip())
-            # we should check if the same book already exists
-            existing_book = Book.query.filter_by(author_id=author.id, title=title.strip()).first()
-            if existing_book:
-                book = existing_book
-            else:
-                book = Book()
-            book.author = author
-            book.title = title.strip()
-            db.session.add(book)
-            # copy the file to the books directory - we can use upload_book_file -
-            # but we don't have the book ID yet
-            added_book_info = (book, file_path)
-            added_books.append(added_book_info)
-    db.session.commit()
-    # after importing, get book IDs
-    # now upload the files - we can use the upload_book_file endpoint
-    for book, file_path in added_books:
-        with open(file_path, 'rb') as f:
-            short_path = os.path.basename(file_path)
-            dest_path = save_book_file(
-                book.id, f, short_path, get_supported_extensions()
+            if any(file_path.lower().endswith(ext) for ext in supported_extensions):
+                yield file_path
+
+
+def extract_file_metadata(file_path):
+    """
+    Read author and title of a file in a worker process, from the metadata cache if the file is unchanged.
+
+    :return: (file_path, author, title, seconds, cached)
+    """
+    started = time.perf_counter()
+    key = file_fingerprint(file_path)
+    try:
+        cached = metadata_cache.get(key)
+    except sqlite3.Error as e:
+        print(f"Metadata cache lookup failed for {file_path}: {e}")
+        cached = None
+    if cached is not None:
+        return file_path, cached['author'], cached['title'], time.perf_counter() - started, True
+    author, title = get_metadata(file_path)
+    # files without metadata are not cached, a later extractor might read them
+    if author or title:
+        try:
+            metadata_cache.put(key, author=author, title=title)
+        except sqlite3.Error as e:
+            print(f"Metadata cache update failed for {file_path}: {e}")
+    return file_path, author, title, time.perf_counter() - started, False
+
+
+def iter_file_metadata(file_paths, workers=IMPORT_WORKERS):
+    """
+    Extract the metadata of files in a process pool while the directory is still being walked.
+    Results come in the order of file_paths, at most workers * 4 files are in flight.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for file_path in file_paths:
+            pending.append(pool.submit(extract_file_metadata, file_path))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # a cancelled job does not wait for the files it will not import
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def book_for_file(file_path, author, title, author_ids, matcher, new_books):
+    print(f"Found supported file: {file_path}")
+    filename = os.path.basename(file_path)
+
+    # try to get author and title from file name if metadata extraction fails
+    if author is None or title is None:
+        just_filename = os.path.splitext(filename)[0]
+        author, title = just_filename.split(' - ', 1) if ' - ' in just_filename else (None, None)
+    if author is None:
+        # If we still don't have an author, we can set a default value
+        # Fallback to file name
+        author = "Unknown"
+        title = os.path.splitext(filename)[0]
+    # generate a Book object
+    # the same code as in confirm_import_api()
+    author_id = author_ids.get(author.strip()) or author_resolver.get_id(author.strip())
+    # we should check if the same book already exists
+    key = compute_match_key(title.strip(), author.strip())
+    existing_id = matcher.match_one(title.strip(), author.strip())
+    if key in new_books:
+        book = new_books[key]
+    elif existing_id is not None:
+        book = db.session.get(Book, existing_id)
+    else:
+        book = Book()
+        new_books[key] = book
+    book.author_id = author_id
+    book.title = title.strip()
+    db.session.add(book)
+    return book, existing_id is not None
+
+
+def timing_summary(timings):
+    """
+    Per-file metadata extraction times: count, total, mean, max and the slowest file.
+    """
+    if not timings:
+        return {'files': 0}
+    slowest_path, slowest = max(timings, key=lambda t: t[1])
+    total = sum(seconds for _, seconds in timings)
+    return {
+        'files': len(timings),
+        'total_seconds': round(total, 3),
+        'mean_seconds': round(total / len(timings), 3),
+        'max_seconds': round(slowest, 3),
+        'slowest_file': os.path.basename(slowest_path),
+    }
+
+
+def import_files(ctx, file_paths, remove_files=True, before_commit=None):
+    """
+    Import book files chunk by chunk, every chunk is committed with the job counters.
+
+    :param file_paths: iterable of the files to import, may be a generator still walking a directory
+    :param remove_files: remove each file once its chunk is committed, otherwise the library gets
+        a reflink or hardlink of the file where the file system allows it
+    :param before_commit: optional callback before_commit(added_books) with the (book, file_path) pairs
+        of a chunk, committed together with the chunk
+    :return: the job result
+    """
+    job = ctx.job
+    started = time.perf_counter()
+    # all match keys of the library are read once, books added by this import are tracked in new_books
+    matcher = BookMatcher(Book, preload=True)
+    new_books = {}
+    added_ids = list((job.result or {}).get('added_books', []))
+    timings = []
+    cache_hits = 0
+    ingest_methods = {}
+    evicted = metadata_cache.evict()
+    if evicted:
+        print(f"Evicted {evicted} old metadata cache entries")
+    metadata = iter_file_metadata(file_paths)
+    while True:
+        chunk = list(islice(metadata, DIRECTORY_CHUNK_SIZE))
+        if not chunk:
+            break
+        timings += [(file_path, seconds) for file_path, _, _, seconds, _ in chunk]
+        cache_hits += sum(1 for *_, cached in chunk if cached)
+        # one author lookup for the chunk, the file name fallback authors are resolved one by one
+        author_ids = get_authors_by_names(author.strip() for _, author, title, _, _ in chunk if author and title)
+        added_books = []  # will store tuple of (book, file_path)
+        matched = 0
+        for file_path, author, title, _, _ in chunk:
+            book, existing = book_for_file(file_path, author, title, author_ids, matcher, new_books)
+            matched += existing
+            added_books.append((book, file_path))
+        # get the book IDs to link the files into the books directory
+        db.session.flush()
+        for book, file_path in added_books:
+            dest_path, method = ingest_book_file(
+                book.id, file_path, get_supported_extensions(), keep_original=not remove_files
             )
             book.file_path = os.path.basename(dest_path)
-        # delete the original file
-        os.remove(file_path)
-
-    added_ids = [book.id for book, _ in added_books]
-    db.session.commit()
-    return jsonify({
+            ingest_methods[method] = ingest_methods.get(method, 0) + 1
+        added_ids += [book.id for book, _ in added_books]
+        job.result = {'added_books': added_ids}
+        if before_commit:
+            before_commit(added_books)
+        ctx.chunk_done(parsed=len(chunk), matched=matched, inserted=len(chunk) - matched)
+        # delete the original files once the books are committed, the library has its own link to them
+        if remove_files:
+            for _, file_path in added_books:
+                os.remove(file_path)
+    timing = timing_summary(timings)
+    timing['wall_seconds'] = round(time.perf_counter() - started, 3)
+    timing['cache_hits'] = cache_hits
+    timing['cache_misses'] = len(timings) - cache_hits
+    print(f"Directory import: {timing}")
+    return {
         "message": "Books imported successfully",
-        "added_books": added_ids
-    }), 200
+        "added_books": added_ids,
+        "timing": timing,
+        "ingest": ingest_methods,
+        "job_id": job.id,
+    }
+
+
+@import_job(JOB_DIRECTORY)
+def run_directory_import(ctx):
+    """
+    Import the book files of a directory. Every chunk of files is committed and then removed from
+    the directory, so a resumed job only finds the files that are left.
+    Kept files are walked in the same order again, a resumed job skips the rows_done files already imported.
+    """
+    job = ctx.job
+    keep = job.params.get('keep', False)
+    file_paths = iter_import_files(job.params['path'])
+    if keep:
+        file_paths = islice(file_paths, job.rows_done, None)
+    return import_files(ctx, file_paths, remove_files=not keep)
@@ -1,16 +1,25 @@
-import csv
-from io import StringIO
-import itertools
 import re
-from flask import Blueprint, jsonify, request
-from authors.authors_tools import extract_main_author, get_author_by_name
+from itertools import islice
+from flask import Blueprint, current_app, jsonify, request
+from authors.authors_tools import extract_main_author, get_authors_by_names
 from book.book_types import AUDIOBOOK, EBOOK, PHYSICAL
 from book_tools import extract_genres, extract_isbn, extract_status, extract_year
-from genres.genres_db import get_genres_ids
-from models import Author, Book, OtherBook, db
+from sqlalchemy import delete
+from models import Book, ImportJob, StagedImport, StagedImportRow, compute_match_key, db
+from tools.book_matcher import BookMatcher
+from tools.catalog_loader import load_catalog
+from tools.csv_stream import open_csv_reader, read_chunks
+from tools.import_jobs import cancel_import_job, import_job, job_dict, job_response, start_import_job
+from tools.staged_imports import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STATUS_STAGED, confirm_staged_import, create_staged_import, finish_staging,
+    get_staged_page, stage_rows, staged_import_dict, update_book_fields,
+)
 from dataclasses import dataclass
 import_bp = Blueprint('import', __name__, url_prefix='/import')
 
+JOB_CSV = 'csv'
+JOB_CATALOG = 'catalog'
+
 
 @dataclass
 class BookImport:
@@ -36,43 +45,91 @@ class DictToClass:
 
 
 
-def update_book_fields(result, book: Book):
-    book.title = result['title']
-    book.author_name = result['author_name']
-    if 'year' in result:
-        book.year_published = result['year']
-    if 'year_published' in result:
-        book.year_published = result['year_published']
-    if 'isbn' in result: 
-        book.isbn = result['isbn']
-    if 'book_type' in result:
-        book.book_type = result['book_type']
-    if 'status' in result:
-        book.status = result['status']
-    if 'rating' in result:
-        book.rating = result['rating']
-    if 'genre' in result:
-        book.genre = result['genre']
-    if 'language' in result:
-        book.language = result['language']
-    if 'synopsis' in result:
-        book.synopsis = result['synopsis']
-    if 'series' in result:
-        book.series = result['series']
-    if 'tags' in result:
-        book.tags = result['tags']
-    if 'page_count' in result:
-        book.page_count = result['page_count']
-    if 'cover_image' in result:
-        book.remote_image_url = result['cover_image']
-    if 'language' in result:
-        book.language = result['language']
-    if 'status' in result:
-        book.status = result['status']
-
-
-def lower_first(iterator):
-    return itertools.chain([next(iterator).lower()], iterator)
+def mark_existing_books(import_books, matcher):
+    """
+    Mark the BookImports that are already in the library, with one lookup for all of them.
+    """
+    existing = matcher.match((b.title, b.author_name) for b in import_books)
+    for import_book in import_books:
+        book_id = existing.get(compute_match_key(import_book.title, import_book.author_name))
+        if book_id is not None:
+            import_book.existing_book = True
+            import_book.existing_book_id = book_id
+    return import_books
+
+
+def parse_csv_row(row):
+    """
+    Convert a Goodreads-style CSV row to a BookImport, None if the row is invalid.
+    """
+    title = row.get('title')
+    author_name = row.get('author')
+    # Check for required fields
+    if not all([title, author_name]):
+        print(f"Skipping row with missing data: {row}")
+        return None
+    author_name = extract_main_author(author_name)
+    isbn = row.get('isbn')
+    isbn13 = row.get('isbn13')
+    isbn = extract_isbn(isbn, isbn13)
+
+    average_rating = row.get('average rating')
+    if not average_rating:
+        average_rating = row.get('rating')
+    number_of_pages = row.get('number of pages')
+    if not number_of_pages:
+        number_of_pages = row.get('pages')
+    # extract just the number from there
+    if number_of_pages:
+        try:
+            match = re.search(r'\d+', number_of_pages)
+            if match:
+                number_of_pages = match.group(0)
+        except Exception:
+            pass
+    year_published = extract_year(row)
+
+    bookshelves = row.get('exclusive shelf')
+    description = row.get('description')
+    language = row.get('language')
+
+    series = row.get('series')
+    # if series is in the format "Series Name #1", extract the name
+    if series:
+        series = series.split('#')[0].strip()
+    cover_image = row.get('coverimg')
+    genres = row.get('genres')
+    genres = extract_genres(genres)
+
+    if not author_name:
+        print(f"Skipping row with missing data: {row}")
+        return None
+
+    # Convert data types
+    try:
+        average_rating = float(average_rating) if average_rating else None
+        number_of_pages = int(number_of_pages) if number_of_pages else None
+        year_published = int(year_published) if year_published else None
+    except (ValueError, TypeError) as e:
+        print(f"Skipping row due to invalid data: {row} - {e}")
+        return None
+
+    return BookImport(
+        title=title,
+        author_name=author_name,
+        book_type=EBOOK,
+        year_published=year_published,
+        isbn=isbn,
+        rating=average_rating,
+        page_count=number_of_pages,
+        status=extract_status(bookshelves),
+        synopsis=description,
+        series=series,
+        cover_image=cover_image,
+        genre=genres,
+        language=language,
+    )
+
 
 @import_bp.route('/import_csv_api', methods=['POST'])
 def import_csv_api():
@@ -86,98 +143,42 @@ def import_csv_api():
     if csv_file.filename == '':
         return jsonify({'status': 'error', 'message': 'No selected file'}), 400
 
-    if csv_file:
-        try:
-            csv_text = csv_file.read().decode('utf-8')
-            csv_data = StringIO(csv_text)
-            reader = csv.DictReader(lower_first(csv_data))
-            imported_count = 0
-            import_books = []
-
-            for row in reader:
-                import_book = BookImport(title=None, author_name=None)
-
-                title = row.get('title')
-                author_name = row.get('author')
-                author_name = extract_main_author(author_name)
-                isbn = row.get('isbn')
-                isbn13 = row.get('isbn13')
-                isbn = extract_isbn(isbn, isbn13)
-
-                average_rating = row.get('average rating')
-                if not average_rating:
-                    average_rating = row.get('rating')
-                number_of_pages = row.get('number of pages')
-                if not number_of_pages:
-                    number_of_pages = row.get('pages')
-                # extract just the number from there
-                if number_of_pages:
-                    try:
-                        match = re.search(r'\d+', number_of_pages)
-                        if match:
-                            number_of_pages = match.group(0)
-                    except Exception:
-                        pass
-                year_published = extract_year(row)
-
-                bookshelves = row.get('exclusive shelf')
-                description = row.get('description')
-                language = row.get('language')
-                
-                series = row.get('series')
-                # if series is in the format "Series Name #1", extract the name
-                if series:
-                    series = series.split('#')[0].strip()
-                cover_image = row.get('coverimg')
-                genres = row.get('genres')
-                genres = extract_genres(genres)
-
-                # Check for required fields
-                if not all([title, author_name]):
-                    print(f"Skipping row with missing data: {row}")
-                    continue
-
-                # Convert data types
-                try:
-                    average_rating = float(average_rating) if average_rating else None
-                    number_of_pages = int(number_of_pages) if number_of_pages else None
-                    year_published = int(year_published) if year_published else None
-                except (ValueError, TypeError) as e:
-                    print(f"Skipping row due to invalid data: {row} - {e}")
-                    continue
-                
-                status = extract_status(bookshelves)
-
-                existing_book = (
-                    Book.query
-                    .join(Author)
-                    .filter(Book.title.ilike(title))
-                    .filter(Author.name.ilike(author_name))
-                    .first()  # Retrieve the first matching book
-                )
-                if existing_book:
-                    import_book.existing_book = True
-                    import_book.existing_book_id = existing_book.id
-
-                import_book.title = title
-                import_book.author_name = author_name
-                import_book.book_type = EBOOK
-                import_book.year_published = year_published
-                import_book.isbn = isbn
-                import_book.rating = average_rating
-                import_book.page_count = number_of_pages
-                import_book.status = status
-                import_book.synopsis = description
-                import_book.series = series
-                import_book.cover_image = cover_image
-                import_book.genre = genres
-                import_book.language = language
-                import_books.append(import_book)
-                imported_count += 1
-            return jsonify({'status': 'success', 'import_books': import_books}), 200
-        except Exception as e:
-            print(f"Error processing CSV file: {e}")
-            return jsonify({'status': 'error', 'message': 'Error processing CSV file'}), 500
+    # parsed and staged in a background job
+    job = start_import_job(current_app._get_current_object(), JOB_CSV, csv_file)
+    return job_response(job, 'Error processing CSV file')
+
+
+@import_job(JOB_CSV)
+def run_csv_import(ctx):
+    """
+    Parse a Goodreads-style CSV chunk by chunk into a staged import, a resumed job continues the same import.
+    """
+    job = ctx.job
+    staged = None
+    if job.params and 'import_id' in job.params:
+        staged = db.session.get(StagedImport, job.params['import_id'])
+    if staged is None:
+        staged = create_staged_import('csv', job.filename)
+        job.params = {**(job.params or {}), 'import_id': staged.id}
+        db.session.commit()
+    matcher = BookMatcher(Book)
+    with open(job.file_path, 'rb') as f:
+        # the file is parsed while it is read, chunks committed by an earlier run are skipped
+        rows = islice(open_csv_reader(f), job.rows_done, None)
+        for chunk in read_chunks(rows):
+            chunk_books = [book for book in map(parse_csv_row, chunk) if book is not None]
+            # one query for the existing books of the whole chunk
+            mark_existing_books(chunk_books, matcher)
+            stage_rows(staged, chunk_books)
+            ctx.chunk_done(
+                parsed=len(chunk),
+                matched=sum(1 for book in chunk_books if book.existing_book),
+                inserted=len(chunk_books),
+                failed=len(chunk) - len(chunk_books),
+            )
+    finish_staging(staged)
+    stats = {'rows': job.rows_parsed, 'imported': job.inserted, 'skipped': job.failed, 'rows_per_second': job.rate}
+    return staged_import_response(staged, stats=stats, job_id=job.id)
 
 
 @import_bp.route('/import_notes_api', methods=['POST'])
@@ -241,26 +242,77 @@ def import_notes_api():
         title = title.strip()
         author_name = author_name.strip()
 
-        # Check if the book already exists in the database
-        existing_book = (
-            Book.query
-            .join(Author)  
-            .filter(Book.title.ilike(title))
-            .filter(Author.name.ilike(author_name)) 
-            .first()  # Retrieve the first matching book
-        )
-        if existing_book:
-            import_book.existing_book = True
-            import_book.existing_book_id = existing_book.id
-
         import_book.title = title
         import_book.author_name = author_name
         import_book.book_type = format
         import_books.append(import_book)
         imported_count += 1
 
+    # Check which books already exist in the database, all at once
+    mark_existing_books(import_books, BookMatcher(Book))
+    staged = create_staged_import('notes')
+    stage_rows(staged, import_books)
+    finish_staging(staged)
     # Redirect to the import details page
-    return jsonify({'status': 'success', 'import_books': import_books}), 200
+    return jsonify(staged_import_response(staged)), 200
+
+
+def staged_import_response(staged, **extra):
+    """
+    Summary of a staged import with the first page of its rows.
+    """
+    response = {'status': 'success'}
+    response.update(staged_import_dict(staged))
+    response.update(page=1, per_page=DEFAULT_PAGE_SIZE, import_books=get_staged_page(staged))
+    response.update(extra)
+    return response
+
+
+@import_bp.route('/staged/<int:import_id>', methods=['GET'])
+def staged_import_api(import_id):
+    """
+    Paged preview of a staged import: ?page=1&per_page=100
+    """
+    staged = StagedImport.query.get_or_404(import_id)
+    page = request.args.get('page', default=1, type=int)
+    per_page = request.args.get('per_page', default=DEFAULT_PAGE_SIZE, type=int)
+    if page < 1 or per_page < 1 or per_page > MAX_PAGE_SIZE:
+        return jsonify({'status': 'error', 'message': f'Invalid page or per_page (max {MAX_PAGE_SIZE})'}), 400
+    response = staged_import_dict(staged)
+    response.update(
+        page=page,
+        per_page=per_page,
+        pages=(staged.total + per_page - 1) // per_page,
+        import_books=get_staged_page(staged, page, per_page),
+    )
+    return jsonify(response), 200
+
+
+@import_bp.route('/staged/<int:import_id>/confirm', methods=['POST'])
+def confirm_staged_import_api(import_id):
+    """
+    Confirm a staged import. The optional body {"actions": {"<row_id>": "add" | "merge" | "skip"}}
+    changes the actions of single rows, the other rows keep their staged action.
+    """
+    staged = StagedImport.query.get_or_404(import_id)
+    if staged.status != STATUS_STAGED:
+        return jsonify({'status': 'error', 'message': f"Import cannot be confirmed, its status is '{staged.status}'"}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        counts = confirm_staged_import(staged, data.get('actions'))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'message': 'Books imported successfully', **counts}), 200
+
+
+@import_bp.route('/staged/<int:import_id>', methods=['DELETE'])
+def delete_staged_import_api(import_id):
+    staged = StagedImport.query.get_or_404(import_id)
+    db.session.execute(delete(StagedImportRow).where(StagedImportRow.import_id == staged.id))
+    db.session.delete(staged)
+    db.session.commit()
+    return jsonify({'status': 'success', 'message': 'Import discarded'}), 200
 
 
 @import_bp.route('/confirm_import_api', methods=['POST'])
@@ -268,6 +320,11 @@ def confirm_import_api():
     if request.method != 'POST':
         return jsonify({'status': 'error', 'message': 'Invalid request method'}), 405
     import_books = request.json
+    # staged imports are confirmed by their id
+    if isinstance(import_books, dict) and 'import_id' in import_books:
+        return confirm_staged_import_api(import_books['import_id'])
+    # resolve all authors up front, the missing ones are inserted with one statement
+    author_ids = get_authors_by_names(result['author_name'].strip() for result in import_books)
 
     for i, result in enumerate(import_books):
         action = 'add'  # default action is to add a new book
@@ -280,23 +337,20 @@ def confirm_import_api():
             if existing_book:
                 # Update existing book
                 update_book_fields(result, existing_book)
-                author = get_author_by_name(result['author_name'].strip())
-                existing_book.author = author
+                existing_book.author_id = author_ids[result['author_name'].strip()]
         else:
             # Create a new book
-            author = get_author_by_name(result['author_name'].strip())
             new_book = Book()
-            new_book.author = author
+            new_book.author_id = author_ids[result['author_name'].strip()]
             # add other fields if added
             update_book_fields(result, new_book)
             db.session.add(new_book)
 
-        db.session.commit()
+    db.session.commit()
 
     return jsonify({'status': 'success', 'message': 'Books imported successfully'}), 200
 
 # Other (all) books import
-# TODO refactor
 @import_bp.route('/import_csv_all_api', methods=['POST'])
 def import_csv_all_api():
     if request.method != 'POST':
@@ -309,89 +363,41 @@ def import_csv_all_api():
     if csv_file.filename == '':
         return jsonify({'status': 'error', 'message': 'No selected file'}), 400
 
-    if csv_file:
-        try:
-            csv_text = csv_file.read().decode('utf-8')
-            csv_data = StringIO(csv_text)
-            reader = csv.DictReader(lower_first(csv_data))
-            imported_count = 0
-
-            for row in reader:
-                title = row.get('title')
-                if len(title) > 190:
-                    # truncate title to 190 characters
-                    title = title[:190] + "..."
-                author_name = row.get('author')
-                author_name = extract_main_author(author_name)
-                isbn = row.get('isbn')
-                isbn13 = row.get('isbn13')
-                isbn = extract_isbn(isbn, isbn13)
-
-                average_rating = row.get('average rating')
-                if not average_rating:
-                    average_rating = row.get('rating')
-                year_published = extract_year(row)
-
-                description = row.get('description')
-                # shorten to 300 characters
-                if description and len(description) > 300:
-                    description = description[:300] + '...'
-                genres = row.get('genres')
-                genres = extract_genres(genres)
-                language = row.get('language')
-                # if language has commas, split it and take the first one
-                if language and ',' in language:
-                    language = language.split(',')[0].strip()
-                if language and ';' in language:
-                    language = language.split(';')[0].strip()
-                # strip to 20 characters
-                if language and len(language) > 20:
-                    language = language[:20]
-
-                # Check for required fields
-                if not all([title, author_name]):
-                    print(f"Skipping row with missing data: {row}")
-                    continue
-
-                # Convert data types
-                try:
-                    average_rating = float(average_rating) if average_rating else None
-                    year_published = int(year_published) if year_published else None
-                except (ValueError, TypeError) as e:
-                    print(f"Skipping row due to invalid data: {row} - {e}")
-                    continue
-                
-                book = None
-                existing_book = (
-                    OtherBook.query
-                    .join(Author)
-                    .filter(OtherBook.title.ilike(title))
-                    .filter(Author.name.ilike(author_name))
-                    .first()  # Retrieve the first matching book
-                )
-                if existing_book:
-                    book = existing_book
-                else:
-                    # Create a new book
-                    book = OtherBook()
-                    author = get_author_by_name(author_name.strip())
-                    book.author = author
-                    db.session.add(book)
-
-                book.title = title
-                book.book_type = EBOOK
-                book.year_published = year_published
-                book.isbn = isbn
-                book.rating = average_rating
-                book.synopsis = description
-                book.language = language
-                # push in genres
-                book.genre = genres
-                genre_ids = get_genres_ids(genres)
-                book.genre_ids = ','.join(map(str, genre_ids))
-                imported_count += 1
-            db.session.commit()
-            return jsonify({'status': f'success, imported {imported_count} books'}), 200
-        except Exception as e:
-            print(f"Error processing CSV file: {e}")
-            return jsonify({'status': 'error', 'message': 'Error processing CSV file'}), 500
\ No newline at end of file
+    # parsed in worker processes and written with bulk upserts, an interrupted load of the same file resumes
+    job = start_import_job(current_app._get_current_object(), JOB_CATALOG, csv_file)
+    return job_response(job, 'Error processing CSV file')
+
+
+@import_job(JOB_CATALOG)
+def run_catalog_import(ctx):
+    with open(ctx.job.file_path, 'rb') as f:
+        stats, resumed_from = load_catalog(f, ctx.job.filename, on_chunk=ctx.chunk_done)
+    return {
+        'status': f'success, imported {stats.imported} books',
+        'stats': stats.as_dict(),
+        'resumed_from_row': resumed_from,
+        'job_id': ctx.job.id,
+    }
+
+
+@import_bp.route('/jobs', methods=['GET'])
+def import_jobs_api():
+    jobs = ImportJob.query.order_by(ImportJob.id.desc()).limit(50)
+    return jsonify([job_dict(job, with_result=False) for job in jobs]), 200
+
+
+@import_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def import_job_api(job_id):
+    """
+    Progress of a background import: rows parsed, matched, inserted and failed, and rows per second.
+    """
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(job_dict(job)), 200
+
+
+@import_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_import_job_api(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    if not cancel_import_job(job):
+        return jsonify({'status': 'error', 'message': f"Job is already {job.status}"}), 400
+    return jsonify({'status': 'success', 'message': 'Cancel requested', 'job': job_dict(job)}), 200
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import timedelta
+from config import METADATA_CACHE_MAX_AGE_DAYS, METADATA_CACHE_PATH
+
+# On-disk cache of extracted book file metadata, so rescanning unchanged files skips the extraction.
+# Files are identified by size, mtime and a hash of their first and last 64 KB, not by path,
+# so a moved or renamed file is still a hit. The cache is a separate SQLite file shared by the
+# import worker processes, independent of the library database.
+
+METADATA_CACHE_MAX_AGE = timedelta(days=METADATA_CACHE_MAX_AGE_DAYS)
+PARTIAL_HASH_BYTES = 64 * 1024
+
+CACHED_FIELDS = ('author', 'title', 'cover_image', 'page_count')
+
+
+def file_fingerprint(file_path):
+    """
+    Cache key of a file: size, mtime and a hash of its beginning and end.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if stat.st_size > 2 * PARTIAL_HASH_BYTES:
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+    return f'{stat.st_size}:{stat.st_mtime_ns}:{digest.hexdigest()}'
+
+
+class MetadataCache:
+    def __init__(self, path=METADATA_CACHE_PATH):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # a connection must not be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS file_metadata ('
+                'key TEXT PRIMARY KEY, author TEXT, title TEXT, cover_image TEXT, page_count INTEGER, '
+                'used_at REAL NOT NULL)'
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """
+        Cached metadata of a file fingerprint as a dictionary, None if it is not cached.
+        """
+        connection = self._connect()
+        row = connection.execute(
+            f'SELECT {", ".join(CACHED_FIELDS)} FROM file_metadata WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE file_metadata SET used_at = ? WHERE key = ?', (time.time(), key))
+        return dict(zip(CACHED_FIELDS, row))
+
+    def put(self, key, **values):
+        unknown = set(values) - set(CACHED_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown metadata fields: {', '.join(sorted(unknown))}")
+        self._connect().execute(
+            f'INSERT OR REPLACE INTO file_metadata (key, {", ".join(CACHED_FIELDS)}, used_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, *(values.get(field) for field in CACHED_FIELDS), time.time()),
+        )
+
+    def evict(self, max_age=METADATA_CACHE_MAX_AGE):
+        """
+        Remove the entries not used for max_age, returns the number of removed entries.
+        """
+        cutoff = time.time() - max_age.total_seconds()
+        return self._connect().execute('DELETE FROM file_metadata WHERE used_at < ?', (cutoff,)).rowcount
+
+
+metadata_cache = MetadataCache()
@@ -1,13 +1,38 @@
-from ebooklib import epub
-from tools.metadata import UNKNOWN
+import zipfile
+from xml.etree import ElementTree
+
+# EPUB metadata straight from the package document (OPF): only container.xml and the OPF
+# entry are read from the zip, the content documents and images are not touched.
+
+CONTAINER_PATH = 'META-INF/container.xml'
+NAMESPACES = {
+    'container': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+}
+
+
+def _text(element):
+    if element is None or not element.text:
+        return None
+    return ' '.join(element.text.split()) or None
+
 
 def get_metadata_epub(epub_path):
-    """Extract author and title metadata from an EPUB file."""
-    try:
-        book = epub.read_epub(epub_path)
-        title = book.get_metadata('DC', 'title')[0][0] if book.get_metadata('DC', 'title') else UNKNOWN
-        author = book.get_metadata('DC', 'creator')[0][0] if book.get_metadata('DC', 'creator') else UNKNOWN
-        return author, title
-    except Exception as e:
-        print(f"Error reading {epub_path}: {e}")
-        return None, None
\ No newline at end of file
+    """
+    Extract author and title metadata from an EPUB file.
+    Returns (author, title), None for missing values. Raises an exception for files that are not valid EPUBs.
+    """
+    with zipfile.ZipFile(epub_path) as epub:
+        container = ElementTree.fromstring(epub.read(CONTAINER_PATH))
+        rootfile = container.find('.//container:rootfile', NAMESPACES)
+        if rootfile is None or not rootfile.get('full-path'):
+            raise ValueError('No rootfile in container.xml')
+        package = ElementTree.fromstring(epub.read(rootfile.get('full-path')))
+    title = _text(package.find('.//dc:title', NAMESPACES))
+    creators = package.findall('.//dc:creator', NAMESPACES)
+    # prefer the creator marked as author (EPUB 2 opf:role), e.g. over the illustrator
+    role = f"{{{NAMESPACES['opf']}}}role"
+    authors = [creator for creator in creators if creator.get(role) in (None, 'aut')]
+    author = _text(authors[0]) if authors else (_text(creators[0]) if creators else None)
+    return author, title
@@ -1,15 +1,22 @@
 from PyPDF2 import PdfReader
-from tools.metadata import UNKNOWN
+
+
+def _clean(value):
+    if not value:
+        return None
+    return ' '.join(str(value).replace('\x00', '').split()) or None
 
 
 def get_metadata_pdf(pdf_path):
-    """Extract author and title metadata from a PDF file."""
-    try:
-        reader = PdfReader(pdf_path)
+    """
+    Extract author and title metadata from a PDF file.
+    Only the trailer and the document info dictionary are read, the file is opened (not loaded)
+    so PdfReader seeks to the objects it needs and the pages are never parsed.
+    Returns (author, title), None for missing values. Raises an exception for unreadable files.
+    """
+    with open(pdf_path, 'rb') as f:
+        reader = PdfReader(f, strict=False)
         metadata = reader.metadata
-        title = metadata.title if metadata and metadata.title else UNKNOWN
-        author = metadata.author if metadata and metadata.author else UNKNOWN
-        return author, title
-    except Exception as e:
-        print(f"Error reading {pdf_path}: {e}")
-        return None, None
\ No newline at end of file
+        if metadata is None:
+            return None, None
+        return _clean(metadata.author), _clean(metadata.title)
@@ -0,0 +1,29 @@
+import os
+from tools.metadata_calibre import get_metadata as get_metadata_calibre
+from tools.metadata_epub import get_metadata_epub
+from tools.metadata_pdf import get_metadata_pdf
+
+# Metadata readers by file extension. The native readers run in-process, Calibre's ebook-meta
+# (a subprocess per file) is used for the other formats (mobi, azw3, djvu, fb2, ...), for files
+# a native reader cannot read and for files without a title and an author in their native metadata.
+
+METADATA_READERS = {
+    '.epub': get_metadata_epub,
+    '.pdf': get_metadata_pdf,
+}
+
+
+def get_metadata(file_path):
+    """
+    Extract (author, title) of a book file, None for values that are not known.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    reader = METADATA_READERS.get(extension)
+    if reader is not None:
+        try:
+            author, title = reader(file_path)
+            if author or title:
+                return author, title
+        except Exception as e:
+            print(f"Native metadata reader failed for {file_path}: {e}, falling back to ebook-meta")
+    return get_metadata_calibre(file_path)
@@ -0,0 +1,217 @@
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, update
+from authors.authors_tools import get_authors_by_names
+from models import Book, StagedImport, StagedImportRow, db, sync_book_terms
+
+# Server-side staging of the CSV and notes imports.
+# The parsed rows are stored under an import id, the client pages through them and confirms
+# with the id and its per-row action changes only. Confirmation writes all books in one transaction.
+
+ACTION_ADD = 'add'
+ACTION_MERGE = 'merge'
+ACTION_SKIP = 'skip'
+ACTIONS = (ACTION_ADD, ACTION_MERGE, ACTION_SKIP)
+
+STATUS_STAGING = 'staging'
+STATUS_STAGED = 'staged'
+STATUS_CONFIRMED = 'confirmed'
+
+STAGED_IMPORT_MAX_AGE = timedelta(days=1)
+CONFIRM_BATCH_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def update_book_fields(result, book: Book, sync_terms=True):
+    book.title = result['title']
+    book.author_name = result['author_name']
+    if 'year' in result:
+        book.year_published = result['year']
+    if 'year_published' in result:
+        book.year_published = result['year_published']
+    if 'isbn' in result:
+        book.isbn = result['isbn']
+    if 'book_type' in result:
+        book.book_type = result['book_type']
+    if 'status' in result:
+        book.status = result['status']
+    if 'rating' in result:
+        book.rating = result['rating']
+    if 'genre' in result:
+        book.genre = result['genre']
+    if 'language' in result:
+        book.language = result['language']
+    if 'synopsis' in result:
+        book.synopsis = result['synopsis']
+    if 'series' in result:
+        book.series = result['series']
+    if 'tags' in result:
+        book.tags = result['tags']
+    if 'page_count' in result:
+        book.page_count = result['page_count']
+    if 'cover_image' in result:
+        book.remote_image_url = result['cover_image']
+    if 'language' in result:
+        book.language = result['language']
+    if 'status' in result:
+        book.status = result['status']
+    # batch callers leave this to the before_flush sync, which looks up all books at once
+    if sync_terms:
+        sync_book_terms(db.session, book)
+
+
+def purge_staged_imports():
+    """
+    Delete the staged imports older than STAGED_IMPORT_MAX_AGE, confirmed or not.
+    """
+    old_ids = select(StagedImport.id).where(StagedImport.created_at < datetime.now() - STAGED_IMPORT_MAX_AGE)
+    old_ids = db.session.execute(old_ids).scalars().all()
+    if old_ids:
+        db.session.execute(delete(StagedImportRow).where(StagedImportRow.import_id.in_(old_ids)))
+        db.session.execute(delete(StagedImport).where(StagedImport.id.in_(old_ids)))
+
+
+def create_staged_import(source, filename=None):
+    purge_staged_imports()
+    staged = StagedImport(source=source, filename=filename, status=STATUS_STAGING, total=0, existing=0)
+    db.session.add(staged)
+    db.session.commit()
+    return staged
+
+
+def stage_rows(staged, import_books):
+    """
+    Append BookImports, already matched against the library, to a staged import (without committing).
+    Rows of existing books default to merge, the others to add.
+    """
+    rows = [
+        {
+            'import_id': staged.id,
+            'position': staged.total + i,
+            'data': asdict(import_book),
+            'existing_book_id': import_book.existing_book_id,
+            'action': ACTION_MERGE if import_book.existing_book_id else ACTION_ADD,
+        }
+        for i, import_book in enumerate(import_books)
+    ]
+    if rows:
+        db.session.execute(insert(StagedImportRow), rows)
+    staged.total += len(rows)
+    staged.existing += sum(1 for row in rows if row['existing_book_id'])
+    return len(rows)
+
+
+def finish_staging(staged):
+    staged.status = STATUS_STAGED
+    db.session.commit()
+
+
+def staged_row_dict(row):
+    data = dict(row.data)
+    data.update(
+        row_id=row.id,
+        existing_book=row.existing_book_id is not None,
+        existing_book_id=row.existing_book_id,
+        action=row.action,
+    )
+    return data
+
+
+def get_staged_page(staged, page=1, per_page=DEFAULT_PAGE_SIZE):
+    """
+    Rows of a staged import for the preview, paged by their position (index on import_id, position).
+    """
+    start = (page - 1) * per_page
+    rows = (
+        StagedImportRow.query
+        .filter(StagedImportRow.import_id == staged.id)
+        .filter(StagedImportRow.position >= start, StagedImportRow.position < start + per_page)
+        .order_by(StagedImportRow.position)
+    )
+    return [staged_row_dict(row) for row in rows]
+
+
+def staged_import_dict(staged):
+    return {
+        'import_id': staged.id,
+        'source': staged.source,
+        'filename': staged.filename,
+        'status': staged.status,
+        'total': staged.total,
+        'existing': staged.existing,
+    }
+
+
+def parse_actions(actions):
+    """
+    Validate the per-row action overrides of a confirmation.
+
+    :param actions: row id -> add/merge/skip, as sent by the client
+    :return: action -> list of row ids
+    :raises ValueError: for unknown actions or invalid row ids
+    """
+    by_action = {}
+    for row_id, action in (actions or {}).items():
+        if action not in ACTIONS:
+            raise ValueError(f"Invalid action '{action}' for row {row_id}")
+        try:
+            by_action.setdefault(action, []).append(int(row_id))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid row id '{row_id}'")
+    return by_action
+
+
+def confirm_staged_import(staged, actions=None):
+    """
+    Write the books of a staged import in one transaction.
+    Rows are processed in batches: one author lookup and one query for the merged books per batch.
+
+    :param actions: row id -> add/merge/skip overrides of the staged actions
+    :return: dictionary with the number of added, merged and skipped rows
+    :raises ValueError: for invalid actions
+    """
+    for action, row_ids in parse_actions(actions).items():
+        db.session.execute(
+            update(StagedImportRow)
+            .where(StagedImportRow.import_id == staged.id, StagedImportRow.id.in_(row_ids))
+            .values(action=action)
+        )
+    counts = {'added': 0, 'merged': 0, 'skipped': 0}
+    last_position = -1
+    while True:
+        fetched = db.session.execute(
+            select(StagedImportRow)
+            .where(StagedImportRow.import_id == staged.id, StagedImportRow.position > last_position)
+            .order_by(StagedImportRow.position)
+            .limit(CONFIRM_BATCH_SIZE)
+        ).scalars().all()
+        if not fetched:
+            break
+        last_position = fetched[-1].position
+        rows = [row for row in fetched if row.action != ACTION_SKIP]
+        counts['skipped'] += len(fetched) - len(rows)
+        author_ids = get_authors_by_names(row.data['author_name'].strip() for row in rows)
+        merge_ids = [row.existing_book_id for row in rows if row.action == ACTION_MERGE and row.existing_book_id]
+        existing = {book.id: book for book in Book.query.filter(Book.id.in_(merge_ids))} if merge_ids else {}
+        books = []
+        for row in rows:
+            book = existing.get(row.existing_book_id) if row.action == ACTION_MERGE else None
+            if book is None:
+                book = Book()
+                db.session.add(book)
+                counts['added'] += 1
+            else:
+                counts['merged'] += 1
+            update_book_fields(row.data, book, sync_terms=False)
+            book.author_id = author_ids[row.data['author_name'].strip()]
+            books.append(book)
+        db.session.flush()
+        # the written books are not needed anymore, keep the session small
+        for obj in set(books) | set(fetched):
+            db.session.expunge(obj)
+    db.session.execute(delete(StagedImportRow).where(StagedImportRow.import_id == staged.id))
+    staged.status = STATUS_CONFIRMED
+    staged.confirmed_at = datetime.now()
+    db.session.commit()
+    return counts
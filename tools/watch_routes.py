@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import delete, func, select
+from config import WATCH_FOLDER, WATCH_INTERVAL
+from models import ImportJob, WatchedFile, db
+from tools.import_jobs import ACTIVE_STATUSES, import_job, job_dict, job_response, start_import_job
+from tools.import_path_routes import BASE_IMPORT_DIR, import_files, iter_import_files, safe_join
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    # without watchdog the watch folder is only polled
+    Observer = None
+
+# Watch folder: new and changed book files under the folder are imported incrementally.
+# The WatchedFile manifest remembers the mtime and size of every imported file, a scan only imports
+# the files that are missing from it or differ. The originals stay in the folder.
+# The folder is polled every WATCH_INTERVAL seconds, with watchdog installed file system events
+# (inotify on Linux) trigger a scan as well.
+
+watch_bp = Blueprint('watch', __name__, url_prefix='/import_path/watch')
+
+JOB_WATCH = 'watch'
+WATCH_SCHEDULER_JOB = 'watch_folder'
+# files modified more recently may still be copied into the folder, they wait for the next scan
+WATCH_SETTLE_SECONDS = 10
+MANIFEST_BATCH_SIZE = 500
+
+
+def load_manifest(abs_path):
+    """
+    Manifest of the files under abs_path: path -> (mtime_ns, size).
+    """
+    rows = db.session.execute(
+        select(WatchedFile.path, WatchedFile.mtime_ns, WatchedFile.size)
+        .where(WatchedFile.path.startswith(abs_path + os.sep, autoescape=True))
+    )
+    return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+
+def iter_changed_files(abs_path, manifest, seen=None):
+    """
+    Yield (path, mtime_ns, size) of the supported files under abs_path that are new or changed.
+
+    :param seen: optional set, collects the paths of all supported files found
+    """
+    settled = time.time_ns() - WATCH_SETTLE_SECONDS * 1_000_000_000
+    for file_path in iter_import_files(abs_path):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        if seen is not None:
+            seen.add(file_path)
+        if manifest.get(file_path) == (stat.st_mtime_ns, stat.st_size) or stat.st_mtime_ns > settled:
+            continue
+        yield file_path, stat.st_mtime_ns, stat.st_size
+
+
+def forget_missing_files(manifest, seen):
+    """
+    Remove the manifest entries of files that are gone from the folder.
+    """
+    missing = [path for path in manifest if path not in seen]
+    for i in range(0, len(missing), MANIFEST_BATCH_SIZE):
+        db.session.execute(delete(WatchedFile).where(WatchedFile.path.in_(missing[i:i + MANIFEST_BATCH_SIZE])))
+    return len(missing)
+
+
+@import_job(JOB_WATCH)
+def run_watch_import(ctx):
+    """
+    Import the new and changed files of the watch folder. The manifest is updated with every chunk,
+    so a resumed job scans again and continues with the files that are left.
+    """
+    abs_path = ctx.job.params['path']
+    manifest = load_manifest(abs_path)
+    seen = set()
+    changed = {}
+
+    def file_paths():
+        for file_path, mtime_ns, size in iter_changed_files(abs_path, manifest, seen):
+            changed[file_path] = (mtime_ns, size)
+            yield file_path
+
+    def record_files(added_books):
+        paths = [file_path for _, file_path in added_books]
+        entries = {entry.path: entry for entry in WatchedFile.query.filter(WatchedFile.path.in_(paths))}
+        for book, file_path in added_books:
+            entry = entries.get(file_path)
+            if entry is None:
+                entry = WatchedFile(path=file_path)
+                db.session.add(entry)
+            entry.mtime_ns, entry.size = changed[file_path]
+            entry.book_id = book.id
+            entry.imported_at = datetime.now()
+
+    result = import_files(ctx, file_paths(), remove_files=False, before_commit=record_files)
+    result['removed_files'] = forget_missing_files(manifest, seen)
+    db.session.commit()
+    return result
+
+
+def get_active_watch_job():
+    return ImportJob.query.filter(ImportJob.kind == JOB_WATCH, ImportJob.status.in_(ACTIVE_STATUSES)).first()
+
+
+def start_watch_import(app, abs_path):
+    """
+    Start a watch folder import, or return the one that is already running.
+    """
+    job = get_active_watch_job()
+    if job is None:
+        job = start_import_job(app, JOB_WATCH, path=abs_path)
+    return job
+
+
+def poll_watch_folder(app, abs_path):
+    # the scan stops at the first changed file, an unchanged folder does not create a job
+    with app.app_context():
+        try:
+            if get_active_watch_job() is not None:
+                return
+            if next(iter_changed_files(abs_path, load_manifest(abs_path)), None) is not None:
+                start_watch_import(app, abs_path)
+        except Exception as e:
+            print(f"Watch folder poll failed: {e}")
+        finally:
+            db.session.remove()
+
+
+class WatchEventHandler:
+    """
+    Watchdog event handler, every event pushes the next scan to WATCH_SETTLE_SECONDS from now,
+    so copying many files results in one scan after the copy.
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def dispatch(self, event):
+        if not event.is_directory:
+            self.watcher.scan_soon()
+
+
+class FolderWatcher:
+    def __init__(self):
+        self.path = None
+        self.interval = None
+        self.scheduler = None
+        self.observer = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.scheduler is not None
+
+    def start(self, app, abs_path, interval):
+        with self._lock:
+            if self.running:
+                return
+            self.path = abs_path
+            self.interval = interval
+            self.scheduler = BackgroundScheduler()
+            self.scheduler.add_job(func=poll_watch_folder,
+                                   args=[app, abs_path],
+                                   trigger='interval',
+                                   seconds=interval,
+                                   id=WATCH_SCHEDULER_JOB,
+                                   next_run_time=datetime.now(),
+                                   coalesce=True,
+                                   max_instances=1)
+            self.scheduler.start()
+            logging.getLogger('apscheduler.scheduler').setLevel(logging.ERROR)
+            if Observer is not None:
+                self.observer = Observer()
+                self.observer.schedule(WatchEventHandler(self), abs_path, recursive=True)
+                self.observer.daemon = True
+                self.observer.start()
+            print(f"Watching {abs_path} every {interval}s{' and for file system events' if self.observer else ''}")
+
+    def scan_soon(self):
+        self.scheduler.modify_job(WATCH_SCHEDULER_JOB,
+                                  next_run_time=datetime.now() + timedelta(seconds=WATCH_SETTLE_SECONDS + 1))
+
+
+folder_watcher = FolderWatcher()
+
+
+def get_watch_path():
+    """
+    Absolute path of the configured watch folder, None if it is not configured or invalid.
+    """
+    if not WATCH_FOLDER:
+        return None
+    try:
+        abs_path = safe_join(BASE_IMPORT_DIR, WATCH_FOLDER)
+    except ValueError:
+        print(f"Invalid watch folder: {WATCH_FOLDER}")
+        return None
+    if not os.path.isdir(abs_path):
+        print(f"Watch folder not found: {abs_path}")
+        return None
+    return abs_path
+
+
+def init_watch_folder(app):
+    abs_path = get_watch_path()
+    if abs_path is None:
+        return
+
+    # started from a request, like the import jobs, so the reloader process does not watch too
+    @app.before_request
+    def start_watching():
+        if not folder_watcher.running:
+            folder_watcher.start(app, abs_path, WATCH_INTERVAL)
+
+
+@watch_bp.route('', methods=['GET'])
+def watch_status():
+    abs_path = folder_watcher.path or get_watch_path()
+    last_job = ImportJob.query.filter_by(kind=JOB_WATCH).order_by(ImportJob.id.desc()).first()
+    files = None
+    if abs_path:
+        files = db.session.execute(
+            select(func.count(WatchedFile.id)).where(WatchedFile.path.startswith(abs_path + os.sep, autoescape=True))
+        ).scalar()
+    return jsonify({
+        'folder': os.path.relpath(abs_path, BASE_IMPORT_DIR) if abs_path else None,
+        'watching': folder_watcher.running,
+        'interval': WATCH_INTERVAL,
+        'file_events': folder_watcher.observer is not None,
+        'files': files,
+        'last_scan': job_dict(last_job, with_result=False) if last_job else None,
+    })
+
+
+@watch_bp.route('/scan', methods=['POST'])
+def scan_watch_folder():
+    """
+    Import the new and changed files now, of the watch folder or of ?path= under the import directory.
+    """
+    rel_path = request.args.get('path')
+    if rel_path is None:
+        abs_path = get_watch_path()
+        if abs_path is None:
+            return jsonify({'status': 'error', 'message': 'No watch folder configured'}), 400
+    else:
+        try:
+            abs_path = safe_join(BASE_IMPORT_DIR, rel_path)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Invalid path'}), 400
+        if not os.path.isdir(abs_path):
+            return jsonify({'status': 'error', 'message': 'Directory not found'}), 404
+    job = start_watch_import(current_app._get_current_object(), abs_path)
+    return job_response(job)